@@ -0,0 +1,485 @@
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import school_db
+import data_transfer
+import write_buffer
+from connection_pool import ConnectionPool
+from entity_cache import EntityCache
+from roster_index import RosterIndex
+from tkinter_display import SqlSource
+
+FIRST_NAMES = ["Amal", "Bilal", "Carla", "Dana", "Elie", "Farah", "Georges", "Hiba", "Imad", "Jana", "Karim", "Lina",
+               "Maya", "Nadim", "Omar", "Perla", "Rami", "Sara", "Tarek", "Yara", "Ziad", "Joelle", "Hadi", "Nour"]
+LAST_NAMES = ["Haddad", "Khoury", "Nassar", "Saad", "Fares", "Hajj", "Karam", "Aoun", "Daher", "Rizk", "Salem",
+              "Mansour", "Chami", "Azar", "Hayek", "Ghanem", "Frem", "Tannous", "Bitar", "Sleiman"]
+SUBJECTS = ["Algebra", "Biology", "Chemistry", "Databases", "Economics", "French", "Geometry", "History",
+            "Informatics", "Literature", "Mechanics", "Networks", "Optics", "Physics", "Statistics"]
+
+# Rows shown by one Tk list and one search page, as in the GUI
+DISPLAY_HEIGHT = 6
+SEARCH_PAGE_SIZE = 100
+# Students removed by one delete_records call; every delete is rolled back
+DELETE_BATCH = 100
+# The .jsonl.gz export is split into this many shards for data_transfer.import_files
+LOAD_SHARDS = 4
+# --stress: writer process counts, and courses shared by the writers; every course has seats
+# for STRESS_SEATS of the enrollments the writers attempt, and student IDs are drawn from
+# STRESS_ID_SPACE times as many IDs as registrations, so some IDs are taken twice
+STRESS_WRITERS = (1, 2, 4, 8)
+STRESS_COURSES = 20
+STRESS_SEATS = 0.75
+STRESS_ID_SPACE = 2
+
+
+def generate_dataset(conn, students, instructors, courses, enrollments, seed=0):
+    """ Fill an empty database with a reproducible synthetic school; the same seed gives the same rows """
+    rng = random.Random(seed)
+    enrollments = min(enrollments, students * courses)
+
+    def person(number):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        return f"{first} {last}", rng.randint(17, 65), f"{first.lower()}.{last.lower()}{number}@school.edu"
+
+    student_ids = [f"S{number:07d}" for number in range(students)]
+    instructor_ids = [f"I{number:05d}" for number in range(instructors)]
+    course_ids = [f"C{number:05d}" for number in range(courses)]
+    pairs = set()
+    while len(pairs) < enrollments:
+        pairs.add((rng.choice(student_ids), rng.choice(course_ids)))
+
+    conn.execute("BEGIN")
+    restore = data_transfer.suspend_triggers_and_indexes(conn, [table for table, _ in data_transfer.EXPORT_TABLES])
+    conn.executemany("INSERT INTO students VALUES (?, ?, ?, ?)",
+                     [(student_id, *person(number)) for number, student_id in enumerate(student_ids)])
+    conn.executemany("INSERT INTO instructors VALUES (?, ?, ?, ?)",
+                     [(instructor_id, *person(number)) for number, instructor_id in enumerate(instructor_ids)])
+    conn.executemany("INSERT INTO courses (course_id, course_name, instructor_id) VALUES (?, ?, ?)",
+                     [(course_id, f"{rng.choice(SUBJECTS)} {rng.randint(100, 499)}", rng.choice(instructor_ids))
+                      for course_id in course_ids])
+    conn.executemany("INSERT INTO enrollments VALUES (?, ?)", sorted(pairs))
+    for sql in restore:
+        conn.execute(sql)
+    school_db.rebuild_derived(conn)
+    conn.commit()
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def measure(fn, repeat, items=1):
+    """ Time repeat calls of fn, then trace one more call for its peak Python memory
+
+    fn gets the iteration number. Returns latency percentiles in
+    milliseconds, throughput in items (rows, records...) per second and
+    the traced peak in KiB.
+    """
+    timings = []
+    for iteration in range(repeat):
+        started = time.perf_counter()
+        fn(iteration)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        fn(repeat)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    timings.sort()
+    return {
+        "runs": repeat,
+        "p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(timings, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+        "max_ms": round(timings[-1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "throughput_per_s": round(items * repeat / sum(timings), 1) if sum(timings) else None,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def search_terms(rng):
+    """ Terms like the ones typed in the search box, one list per criterion """
+    return {
+        "Name": [rng.choice(FIRST_NAMES)[:rng.randint(2, 5)] for _ in range(64)],
+        "ID": [f"S{rng.randint(0, 99):02d}" for _ in range(64)],
+        "Email": [rng.choice(LAST_NAMES).lower()[:4] for _ in range(64)],
+        "Course": [rng.choice(SUBJECTS)[:rng.randint(3, 6)] for _ in range(64)],
+    }
+
+
+def run_data_benchmarks(path, workdir, repeat, heavy_repeat, seed):
+    """ Time the data functions behind the GUI actions on the database at path """
+    rng = random.Random(seed)
+    results = {}
+    pool = ConnectionPool(path)
+    conn = school_db.connect(path)
+    try:
+        counts = {category: school_db.count_records(conn, category) for category in school_db.PAGE_QUERIES}
+
+        # perform_search: the first page of results
+        for criteria, terms in search_terms(rng).items():
+            results[f"search_{criteria.lower()}"] = measure(
+                lambda i: school_db.search(conn, criteria, terms[i % len(terms)], limit=SEARCH_PAGE_SIZE), repeat)
+
+        # update_display: what VirtualListbox.refresh and a scroll read, from SQLite and from the cache
+        cache = EntityCache()
+        results["cache_full_load"] = measure(lambda i: EntityCache().sync(conn), heavy_repeat,
+                                             items=sum(counts.values()))
+        cache.sync(conn)
+        for name, source in (("sql", SqlSource(pool)), ("cache", cache)):
+            def refresh(i, source=source):
+                for category in school_db.PAGE_QUERIES:
+                    source.count_records(category)
+                    source.list_page(category, None, DISPLAY_HEIGHT)
+            results[f"display_refresh_{name}"] = measure(refresh, repeat, items=len(school_db.PAGE_QUERIES))
+            results[f"display_jump_{name}"] = measure(
+                lambda i, source=source: source.list_at("Students", rng.randrange(max(counts["Students"], 1)),
+                                                        DISPLAY_HEIGHT), repeat)
+
+        # update_record_listbox: the first page of the delete list
+        for category in school_db.PAGE_QUERIES:
+            results[f"record_list_{category.lower()}"] = measure(
+                lambda i, category=category: school_db.list_page(conn, category, None, 200), repeat, items=200)
+
+        # The Tk summary panel and the course list sorted by enrollment, read from the count tables
+        results["summary_read"] = measure(lambda i: school_db.read_summary(conn), repeat)
+        results["course_list_most_enrolled"] = measure(
+            lambda i: school_db.list_courses(conn, "Most enrolled", None, 200), repeat, items=200)
+
+        # Roster query: students in both of the two largest courses, from the enrollment bitsets and in SQL
+        roster = RosterIndex()
+
+        def load_roster(i):
+            roster.seq = None
+            roster.sync(conn)
+            conn.commit()
+        results["roster_index_load"] = measure(load_roster, heavy_repeat)
+        first, second = [row[0] for row in school_db.list_courses(conn, "Most enrolled", None, 2)]
+        results["roster_and"] = measure(lambda i: roster.evaluate(f"{first} and {second}"), repeat)
+        results["roster_and_sql"] = measure(lambda i: conn.execute(
+            "SELECT student_id FROM enrollments WHERE course_id = ? INTERSECT "
+            "SELECT student_id FROM enrollments WHERE course_id = ?", (first, second)).fetchall(), repeat)
+
+        # Deleting a student in both courses must take them out of every roster, overlap counts included
+        shared = conn.execute("SELECT student_id FROM enrollments WHERE course_id = ? INTERSECT "
+                              "SELECT student_id FROM enrollments WHERE course_id = ?", (first, second)).fetchall()
+        enrolled = conn.execute("SELECT student_id FROM enrollments WHERE course_id = ?", (first,)).fetchall()
+        school_db.delete_records(conn, "Students", [row[0] for row in (shared or enrolled)[:1]])
+        roster.sync(conn)
+        expected = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM enrollments a JOIN enrollments b USING (student_id) "
+            "WHERE a.course_id = ? AND b.course_id = ?), (SELECT COUNT(*) FROM enrollments WHERE course_id = ?), "
+            "(SELECT COUNT(*) FROM enrollments WHERE course_id = ?)", (first, second, first, second)).fetchone()
+        overlap = tuple(count for _, _, count in roster.overlap([first, second]))
+        conn.rollback()
+        if overlap != expected:
+            raise RuntimeError(f"Roster overlap after a delete: {overlap}, the enrollments hold {expected}")
+
+        # delete_record: a batch of selected students, rolled back so every run sees the same data
+        student_keys = [row[0] for row in school_db.list_page(conn, "Students", None, 10 * DELETE_BATCH)]
+
+        def delete_batch(i):
+            school_db.delete_records(conn, "Students", rng.sample(student_keys, min(DELETE_BATCH, len(student_keys))))
+            conn.rollback()
+        results["delete_batch"] = measure(delete_batch, repeat, items=DELETE_BATCH)
+
+        # save_data and load_data in each kind of file
+        rows = sum(counts.values()) + conn.execute("SELECT COUNT(*) FROM enrollments").fetchone()[0]
+        for extension in (".jsonl.gz", ".json", data_transfer.SNAPSHOT_EXTENSION):
+            filename = os.path.join(workdir, "export" + extension)
+            label = extension.strip(".").replace(".", "_")
+
+            def save(i, filename=filename):
+                data_transfer.export_file(conn, filename)
+                conn.commit()
+            results[f"save_{label}"] = measure(save, heavy_repeat, items=rows)
+
+            def load(i, filename=filename):
+                data_transfer.import_file(conn, filename, "replace")
+                conn.commit()
+            results[f"load_{label}"] = measure(load, heavy_repeat, items=rows)
+
+        # Load several files at once: the export split round-robin into shards, parsed in parallel
+        with gzip.open(os.path.join(workdir, "export.jsonl.gz"), "rt", encoding="utf-8") as file:
+            lines = file.readlines()
+        shards = [os.path.join(workdir, f"shard{number}.jsonl.gz") for number in range(LOAD_SHARDS)]
+        for number, shard in enumerate(shards):
+            with gzip.open(shard, "wt", encoding="utf-8") as file:
+                file.writelines(lines[number::LOAD_SHARDS])
+        del lines
+
+        def load_sharded(i):
+            data_transfer.import_files(conn, shards, "replace")
+            conn.commit()
+        results["load_sharded"] = measure(load_sharded, heavy_repeat, items=rows)
+
+        # Back Up: a full backup into a new folder, then a delta after registering one student
+        backup_dir = os.path.join(workdir, "backups")
+
+        def full_backup(i):
+            shutil.rmtree(backup_dir, ignore_errors=True)
+            data_transfer.backup(conn, backup_dir)
+            conn.commit()
+        results["backup_full"] = measure(full_backup, heavy_repeat, items=rows)
+        course_id = school_db.list_page(conn, "Courses", None, 1)[0][0]
+
+        def delta_backup(i):
+            school_db.add_student(conn, f"B{i:07d}", "Backup Student", 20, "backup@school.edu", [course_id])
+            data_transfer.backup(conn, backup_dir)
+            conn.commit()
+        results["backup_delta"] = measure(delta_backup, repeat)
+
+        # Restoring the chain must work when a delta re-inserts an enrollment of a course at capacity
+        enrolled = conn.execute("SELECT enrolled FROM course_stats WHERE course_id = ?", (course_id,)).fetchone()[0]
+        conn.execute("UPDATE courses SET capacity = ? WHERE course_id = ?", (enrolled, course_id))
+        student_id = conn.execute("SELECT student_id FROM enrollments WHERE course_id = ?", (course_id,)).fetchone()[0]
+        conn.execute("DELETE FROM enrollments WHERE student_id = ? AND course_id = ?", (student_id, course_id))
+        conn.execute("INSERT INTO enrollments (student_id, course_id) VALUES (?, ?)", (student_id, course_id))
+        conn.commit()
+        data_transfer.backup(conn, backup_dir)
+        conn.commit()
+        data_transfer.import_file(conn, os.path.join(backup_dir, data_transfer.BACKUP_MANIFEST))
+        restored = conn.execute("SELECT enrolled FROM course_stats WHERE course_id = ?", (course_id,)).fetchone()[0]
+        conn.execute("UPDATE courses SET capacity = NULL WHERE course_id = ?", (course_id,))
+        conn.commit()
+        if restored != enrolled:
+            raise RuntimeError(f"Backup restore: {restored} students in {course_id}, {enrolled} were backed up")
+
+        # Form submissions: each in its own transaction, or queued by a WriteBuffer and written FLUSH_SIZE at a time
+        def submit_direct(i):
+            school_db.add_student(conn, f"F{i:07d}", "Form Student", 20, "form@school.edu", [course_id])
+        results["form_submit_direct"] = measure(submit_direct, repeat)
+        cache = EntityCache()
+        cache.sync(conn)
+        buffer = write_buffer.WriteBuffer(cache, path)
+
+        def submit_queued(i):
+            for number in range(write_buffer.FLUSH_SIZE):
+                buffer.add("student", f"Q{i:03d}{number:05d}", "Form Student", 20, "form@school.edu", [course_id])
+            submissions, replayed = buffer.take()
+            school_db.apply_submissions(conn, submissions, replayed)
+            buffer.flushed(True)
+        results["form_submit_queued"] = measure(submit_queued, heavy_repeat, items=write_buffer.FLUSH_SIZE)
+        buffer.close()
+    finally:
+        conn.close()
+        pool.close()
+    return results
+
+
+def run_qt_benchmarks(workdir, repeat, seed):
+    """ Time the same actions through SchoolManagementApp on the offscreen Qt platform """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5 import QtWidgets
+    import pyqt5_main
+
+    rng = random.Random(seed)
+    results = {}
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    pyqt5_main.SchoolManagementApp.show_message = lambda self, title, message: None
+    try:
+        def wait_for(condition, timeout=30):
+            deadline = time.perf_counter() + timeout
+            while not condition() and time.perf_counter() < deadline:
+                app.processEvents()
+                time.sleep(0.0005)
+
+        window = pyqt5_main.SchoolManagementApp(started=time.perf_counter())
+        window.show()
+        # The phase is marked when the first cache sync reaches the GUI thread, after cache.loaded is set
+        wait_for(lambda: "records loaded" in window.startup.phases)
+        phases = window.startup.phases
+        if "records loaded" not in phases:
+            raise RuntimeError("The Qt window did not load its records in time")
+        results["qt_startup"] = {"runs": 1, "first_paint_ms": phases.get("first paint"),
+                                 "records_loaded_ms": phases.get("records loaded")}
+
+        terms = search_terms(rng)
+        for criteria in school_db.SEARCH_CRITERIA:
+            def search(i, criteria=criteria):
+                window.search_cache.clear()
+                window.search_criteria.setCurrentText(criteria)
+                window.search_entry.setText(terms[criteria][i % len(terms[criteria])])
+                window.perform_search()
+                wait_for(lambda: window.search_results.rowCount() > 0)
+            results[f"qt_search_{criteria.lower()}"] = measure(search, repeat)
+
+        categories = list(school_db.PAGE_QUERIES)
+
+        def record_list(i):
+            window.category_combobox.setCurrentText(categories[i % len(categories)])
+            wait_for(lambda: window.records.rowCount() > 0 or window.cache.count_records(window.records.category) == 0)
+        results["qt_record_list"] = measure(record_list, repeat)
+        window.close()
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def stress_writer(path, writer, registrations, id_space, seed):
+    """ One stress process: register students one transaction at a time, as a separate app instance would """
+    rng = random.Random(seed * 1000 + writer)
+    course_ids = [f"C{number:05d}" for number in range(STRESS_COURSES)]
+    outcomes = {"registered": 0, "duplicate": 0, "full": 0, "locked": 0}
+    timings = []
+    conn = school_db.connect(path)
+    started = time.time()
+    for _ in range(registrations):
+        student_id = f"S{rng.randrange(id_space):07d}"
+        began = time.perf_counter()
+        try:
+            school_db.add_student(conn, student_id, "Stress Student", 20, f"{student_id.lower()}@school.edu",
+                                  rng.sample(course_ids, 2))
+            outcomes["registered"] += 1
+        except ValueError as e:
+            outcomes["full" if "full" in str(e) else "duplicate"] += 1
+        except school_db.sqlite3.OperationalError:
+            outcomes["locked"] += 1
+        timings.append(time.perf_counter() - began)
+    finished = time.time()
+    conn.close()
+    return outcomes, timings, started, finished
+
+
+def run_stress_benchmarks(workdir, writer_counts, registrations, seed):
+    """ Register students from several processes at once on one database file, for each writer count
+
+    Reports registrations per second over the whole run, latency per
+    registration, how often an ID was already taken or a course full, and
+    how many registrations gave up on the lock. oversold_courses counts
+    courses holding more students than their capacity, and must stay 0.
+    """
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for writers in writer_counts:
+        path = os.path.join(workdir, f"stress_{writers}.db")
+        attempts = writers * registrations
+        capacity = int(attempts * 2 / STRESS_COURSES * STRESS_SEATS)
+        conn = school_db.connect(path)
+        school_db.create_tables(conn)
+        school_db.add_instructor(conn, "I00000", "Stress Instructor", 40, "stress@school.edu")
+        for number in range(STRESS_COURSES):
+            school_db.add_course(conn, f"C{number:05d}", f"Course {number}", "I00000", capacity)
+        conn.commit()
+        conn.close()
+
+        with context.Pool(writers) as pool:
+            runs = pool.starmap(stress_writer, [(path, writer, registrations, attempts * STRESS_ID_SPACE, seed)
+                                                for writer in range(writers)])
+        outcomes = {name: sum(run[0][name] for run in runs) for name in runs[0][0]}
+        timings = sorted(timing for run in runs for timing in run[1])
+        seconds = max(run[3] for run in runs) - min(run[2] for run in runs)
+
+        conn = school_db.connect(path)
+        students = school_db.count_records(conn, "Students")
+        oversold = conn.execute("SELECT COUNT(*) FROM courses WHERE capacity < "
+                                "(SELECT COUNT(*) FROM enrollments WHERE course_id = courses.course_id)").fetchone()[0]
+        conn.close()
+        if students != outcomes["registered"]:
+            raise RuntimeError(f"{writers} writers: {outcomes['registered']} registered but {students} students stored")
+
+        results[f"stress_{writers}_writers"] = {
+            "runs": attempts,
+            "p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+            "p90_ms": round(percentile(timings, 0.90) * 1000, 3),
+            "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+            "max_ms": round(timings[-1] * 1000, 3),
+            "registrations_per_s": round(outcomes["registered"] / seconds, 1) if seconds else None,
+            "duplicate_rate": round(outcomes["duplicate"] / attempts, 4),
+            "full_rate": round(outcomes["full"] / attempts, 4),
+            "lock_errors": outcomes["locked"],
+            "oversold_courses": oversold,
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """ Return the operations whose median latency grew by more than tolerance (0.2 = 20%) over the baseline """
+    regressions = []
+    for name, result in results["operations"].items():
+        before = baseline.get("operations", {}).get(name, {}).get("p50_ms")
+        if before and result.get("p50_ms") and result["p50_ms"] > before * (1 + tolerance):
+            regressions.append({"operation": name, "baseline_p50_ms": before, "p50_ms": result["p50_ms"]})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths on a synthetic school database")
+    parser.add_argument("--students", type=int, default=100000)
+    parser.add_argument("--instructors", type=int, default=500)
+    parser.add_argument("--courses", type=int, default=2000)
+    parser.add_argument("--enrollments", type=int, default=300000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=50, help="runs of each fast operation")
+    parser.add_argument("--heavy-repeat", type=int, default=3, help="runs of each save, load and cache load")
+    parser.add_argument("--qt", action="store_true", help="also time the widgets on the offscreen Qt platform")
+    parser.add_argument("--stress", action="store_true",
+                        help="also register students from several processes at once (see --stress-writers)")
+    parser.add_argument("--stress-writers", default=",".join(map(str, STRESS_WRITERS)),
+                        help="comma-separated writer process counts")
+    parser.add_argument("--stress-registrations", type=int, default=200, help="registrations per writer process")
+    parser.add_argument("--output", help="write the JSON report here instead of standard output")
+    parser.add_argument("--baseline", help="earlier JSON report to compare median latencies with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed median slowdown over the baseline")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="school_bench_")
+    try:
+        path = os.path.join(workdir, school_db.DB_PATH)
+        conn = school_db.connect(path)
+        school_db.create_tables(conn)
+        conn.commit()
+        started = time.perf_counter()
+        generate_dataset(conn, args.students, args.instructors, args.courses, args.enrollments, args.seed)
+        generate_seconds = time.perf_counter() - started
+        conn.close()
+
+        operations = run_data_benchmarks(path, workdir, args.repeat, args.heavy_repeat, args.seed)
+        if args.qt:
+            operations.update(run_qt_benchmarks(workdir, max(args.repeat // 5, 1), args.seed))
+        if args.stress:
+            writer_counts = [int(count) for count in args.stress_writers.split(",")]
+            operations.update(run_stress_benchmarks(workdir, writer_counts, args.stress_registrations, args.seed))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "dataset": {"students": args.students, "instructors": args.instructors, "courses": args.courses,
+                    "enrollments": args.enrollments, "seed": args.seed,
+                    "generate_seconds": round(generate_seconds, 3)},
+        "python": sys.version.split()[0],
+        "sqlite": school_db.sqlite3.sqlite_version,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "operations": operations,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            results["regressions"] = compare(results, json.load(file), args.tolerance)
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report + "\n")
+    else:
+        print(report)
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
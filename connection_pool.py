@@ -0,0 +1,74 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+import school_db
+
+
+class ConnectionPool:
+    """ Shares SQLite connections between threads: pooled readers and one writer
+
+    reader() lends a read-only connection, reusing idle ones (and their
+    prepared statement caches) and opening at most size of them; when all
+    are busy it waits for one to come back. writer() lends the single
+    writable connection to one thread at a time, so every write in the
+    process goes through it in turn. Connections are opened with metrics,
+    when given, so their statements are timed.
+    """
+
+    def __init__(self, path=school_db.DB_PATH, size=4, metrics=None):
+        self.path = path
+        self.size = size
+        self.metrics = metrics
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.write_conn = None
+
+    @contextmanager
+    def reader(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put(conn)
+
+    @contextmanager
+    def writer(self):
+        with self.write_lock:
+            if self.write_conn is None:
+                self.write_conn = school_db.connect(self.path, check_same_thread=False, metrics=self.metrics)
+            yield self.write_conn
+
+    def close(self):
+        """ Close the idle readers and the writer """
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self.write_lock:
+            if self.write_conn is not None:
+                self.write_conn.close()
+                self.write_conn = None
+
+    def _acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            can_open = self.opened < self.size
+            if can_open:
+                self.opened += 1
+        if not can_open:
+            return self.idle.get()
+        try:
+            return school_db.connect(self.path, read_only=True, check_same_thread=False, metrics=self.metrics)
+        except BaseException:
+            with self.lock:
+                self.opened -= 1
+            raise
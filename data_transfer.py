@@ -0,0 +1,796 @@
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import school_db
+
+# (table, exported columns) in the order they are written and must be loaded
+EXPORT_TABLES = [
+    ("students", ("student_id", "name", "age", "email")),
+    ("instructors", ("instructor_id", "name", "age", "email")),
+    ("courses", ("course_id", "course_name", "instructor_id", "capacity")),
+    ("enrollments", ("student_id", "course_id")),
+]
+# Columns added after the file format was first written; older files load them as NULL
+OPTIONAL_COLUMNS = {"capacity"}
+# table -> its exported columns, and the ones identifying one of its rows
+EXPORT_COLUMNS = dict(EXPORT_TABLES)
+KEY_COLUMNS = dict(school_db.JOURNALED_TABLES)
+# Rows read per fetchmany call while exporting
+EXPORT_CHUNK_SIZE = 5000
+# Rows inserted per executemany call while importing
+IMPORT_BATCH_SIZE = 10000
+# PRAGMA cache_size used during an import (negative values are in KiB, so 256 MiB)
+IMPORT_CACHE_SIZE = -256 * 1024
+IMPORT_MODES = ("replace", "append", "upsert")
+# Tables import_files inserts as soon as a shard is parsed; the others wait for every shard,
+# so no child row is inserted before a parent that a later shard may hold
+SHARD_EARLY_TABLES = ("students", "instructors")
+
+WHITESPACE = re.compile(r"\s*")
+
+SNAPSHOT_EXTENSION = ".sqlite"
+# Database pages copied per backup step, between two progress reports
+SNAPSHOT_PAGES = 4096
+
+FILE_FORMATS = [
+    ("JSON Files (*.json)", ".json"),
+    ("JSON Lines (*.jsonl)", ".jsonl"),
+    ("Compressed JSON (*.json.gz)", ".json.gz"),
+    ("Compressed JSON Lines (*.jsonl.gz)", ".jsonl.gz"),
+    ("School Snapshot (*.sqlite)", SNAPSHOT_EXTENSION),
+]
+
+# Incremental backups: a directory whose BACKUP_MANIFEST chains a full export and the deltas after it
+BACKUP_MANIFEST = "manifest.json"
+BACKUP_EXTENSION = ".jsonl.gz"
+BACKUP_FORMAT = 1
+# Keys looked up per query while writing a delta
+BACKUP_CHUNK_SIZE = 400
+
+# Columns of a student list for bulk registration; course_ids holds several IDs
+STUDENT_COLUMNS = ("student_id", "name", "age", "email", "course_ids")
+STUDENT_LIST_FILTER = "Student Lists (*.csv *.csv.gz *.jsonl *.jsonl.gz)"
+
+
+def file_filter(backups=False):
+    """ Filter string for the Qt file dialogs; backups adds backup manifests, which can be loaded but not saved """
+    names = [name for name, _ in FILE_FORMATS] + ([f"Backup Manifest ({BACKUP_MANIFEST})"] if backups else [])
+    return ";;".join(names) + ";;All Files (*)"
+
+
+def with_extension(filename, selected_filter):
+    """ Append the extension of the selected filter unless filename already has a known one """
+    extensions = sorted((extension for _, extension in FILE_FORMATS), key=len, reverse=True)
+    if filename.endswith(tuple(extensions)):
+        return filename
+    for name, extension in FILE_FORMATS:
+        if name == selected_filter:
+            return filename + extension
+    return filename
+
+
+def open_text(filename, mode, compressed=None):
+    """ Open a data file for text reading or writing, gzip-compressed if it ends with .gz """
+    if compressed is None:
+        compressed = filename.endswith(".gz")
+    if compressed:
+        return gzip.open(filename, mode + "t", encoding="utf-8")
+    return open(filename, mode, encoding="utf-8")
+
+
+def is_snapshot(filename):
+    return filename.endswith(SNAPSHOT_EXTENSION)
+
+
+def is_json_lines(filename):
+    return filename.endswith((".jsonl", ".jsonl.gz"))
+
+
+def iter_table(conn, table, columns):
+    """ Yield the rows of a table as dicts, one fetchmany chunk at a time """
+    cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table}")
+    while True:
+        rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+        if not rows:
+            break
+        yield [dict(zip(columns, row)) for row in rows]
+
+
+def export_file(conn, filename, progress=None):
+    """ Write every table to a JSON or JSON Lines file, optionally gzip-compressed
+
+    Rows are streamed from the cursors straight into the file, so memory use
+    does not grow with the database. The file is written next to its target
+    and renamed into place once complete. Snapshot files are written by
+    save_snapshot instead.
+    """
+    if is_snapshot(filename):
+        return save_snapshot(conn, filename, progress)
+
+    # One read transaction so all tables come from the same snapshot
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    total = sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table, _ in EXPORT_TABLES)
+    done = 0
+    json_lines = is_json_lines(filename)
+    temp_filename = filename + ".part"
+
+    try:
+        with open_text(temp_filename, "w", filename.endswith(".gz")) as file:
+            if not json_lines:
+                file.write("{")
+            for number, (table, columns) in enumerate(EXPORT_TABLES):
+                if not json_lines:
+                    file.write(f'{", " if number else ""}"{table}": [')
+                first = True
+                for records in iter_table(conn, table, columns):
+                    if json_lines:
+                        file.writelines(json.dumps({"table": table, **record}) + "\n" for record in records)
+                    else:
+                        file.write(("" if first else ", ") + ", ".join(json.dumps(record) for record in records))
+                    first = False
+                    done += len(records)
+                    if progress:
+                        progress(done, total)
+                if not json_lines:
+                    file.write("]")
+            if not json_lines:
+                file.write("}")
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
+def iter_json_records(file, read_size=1 << 16):
+    """ Yield (table, record) pairs from an export_file JSON document without loading it whole """
+    decoder = json.JSONDecoder()
+    state = {"buffer": "", "pos": 0}
+
+    def peek():
+        """ Skip whitespace and return the next character, or "" at the end of the file """
+        while True:
+            buffer = state["buffer"]
+            pos = state["pos"] = WHITESPACE.match(buffer, state["pos"]).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if not read_more():
+                return ""
+
+    def read_more():
+        chunk = file.read(read_size)
+        if not chunk:
+            return False
+        state["buffer"] = state["buffer"][state["pos"]:] + chunk
+        state["pos"] = 0
+        return True
+
+    def expect(character):
+        if peek() != character:
+            raise ValueError(f"Invalid data file: expected '{character}'")
+        state["pos"] += 1
+
+    def value():
+        peek()
+        while True:
+            try:
+                result, end = decoder.raw_decode(state["buffer"], state["pos"])
+            except json.JSONDecodeError:
+                # Keys and records are self-delimiting, so a failure means the value is cut off
+                if not read_more():
+                    raise
+                continue
+            state["pos"] = end
+            return result
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        table = value()
+        expect(":")
+        expect("[")
+        if peek() != "]":
+            while True:
+                yield table, value()
+                if peek() != ",":
+                    break
+                state["pos"] += 1
+        expect("]")
+        if peek() != ",":
+            break
+        state["pos"] += 1
+    expect("}")
+
+
+def iter_file_records(file, json_lines, name=""):
+    """ Yield (table, record) pairs from an open export file of either format
+
+    Raises ValueError naming the file when a line is not JSON, or a record
+    is not an object or has no table.
+    """
+    try:
+        if json_lines:
+            records = ((record.pop("table", None) if isinstance(record, dict) else None, record)
+                       for record in (json.loads(line) for line in file if line.strip()))
+        else:
+            records = iter_json_records(file)
+        for table, record in records:
+            if not isinstance(table, str) or not isinstance(record, dict):
+                raise ValueError(f"Invalid data file {name}: bad record {record}")
+            yield table, record
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid data file {name}: {e}")
+
+
+def record_key(table, record, name=""):
+    """ Return the key tuple of one exported record; raise ValueError naming the file if it has none
+
+    Key columns must be non-empty strings: SQLite would store a NULL key
+    in a TEXT PRIMARY KEY column.
+    """
+    if table not in KEY_COLUMNS:
+        raise ValueError(f"Invalid data file {name}: unknown table {table}")
+    key = tuple(record.get(column) for column in KEY_COLUMNS[table])
+    if not all(isinstance(value, str) and value for value in key):
+        raise ValueError(f"Invalid data file {name}: {table} record without its ID {record}")
+    return key
+
+
+def record_row(table, record, name=""):
+    """ Return the row tuple of one exported record, in EXPORT_TABLES column order; raise ValueError if it is bad """
+    record_key(table, record, name)
+    try:
+        return tuple(record.get(column) if column in OPTIONAL_COLUMNS else record[column]
+                     for column in EXPORT_COLUMNS[table])
+    except KeyError:
+        raise ValueError(f"Invalid data file {name}: bad {table} record {record}")
+
+
+def iter_file_rows(filename):
+    """ Yield (table, row, bytes of the file read so far) for every record of an export file, checked by record_row """
+    name = os.path.basename(filename)
+    with open(filename, "rb") as raw:
+        stream = gzip.GzipFile(fileobj=raw) if filename.endswith(".gz") else raw
+        with io.TextIOWrapper(stream, encoding="utf-8") as file:
+            for table, record in iter_file_records(file, is_json_lines(filename), name):
+                yield table, record_row(table, record, name), raw.tell()
+
+
+def suspend_triggers_and_indexes(conn, tables):
+    """ Drop the triggers and secondary indexes on tables and return the SQL that recreates them """
+    placeholders = ", ".join("?" * len(tables))
+    rows = conn.execute(f"SELECT type, name, sql FROM sqlite_master WHERE type IN ('trigger', 'index') "
+                        f"AND sql IS NOT NULL AND tbl_name IN ({placeholders})", tables).fetchall()
+    for object_type, name, _ in rows:
+        conn.execute(f'DROP {object_type.upper()} "{name}"')
+    return [sql for _, _, sql in rows]
+
+
+def insert_statement(table, columns, mode, source=None):
+    """ INSERT for one table: plain for replace, keep existing rows for append, overwrite them for upsert
+
+    Rows come from parameters, or from the same table of the attached
+    database source when it is given.
+    """
+    key_columns = ("student_id", "course_id") if table == "enrollments" else columns[:1]
+    if source:
+        # WHERE true keeps SQLite from reading ON CONFLICT as part of the SELECT
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {source}.{table} WHERE true"
+    else:
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    other_columns = [column for column in columns if column not in key_columns]
+    if mode == "append" or (mode == "upsert" and not other_columns):
+        sql += " ON CONFLICT DO NOTHING"
+    elif mode == "upsert":
+        sql += f" ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET " + \
+               ", ".join(f"{column} = excluded.{column}" for column in other_columns)
+    return sql
+
+
+def import_file(conn, filename, mode="replace", progress=None):
+    """ Load a file written by export_file in one transaction
+
+    mode is "replace" (delete everything first), "append" (keep existing
+    records on conflicts) or "upsert" (overwrite them). Records are parsed
+    incrementally and inserted with executemany in batches. Foreign keys are
+    checked at commit, and the triggers and secondary indexes of the tables
+    are dropped during the load and rebuilt afterwards. Any error rolls the
+    whole load back. Snapshot files are loaded by restore_snapshot instead.
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Unknown import mode: {mode}")
+    if is_snapshot(filename):
+        return restore_snapshot(conn, filename, mode, progress)
+    if is_backup_manifest(filename):
+        if mode != "replace":
+            raise ValueError("A backup can only replace all records")
+        return restore_backup(conn, filename, progress)
+    tables = [table for table, _ in EXPORT_TABLES]
+    columns = dict(EXPORT_TABLES)
+    statements = {table: insert_statement(table, columns[table], mode) for table in tables}
+    size = os.path.getsize(filename)
+
+    previous_cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    conn.execute(f"PRAGMA cache_size = {IMPORT_CACHE_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    try:
+        conn.execute("BEGIN")
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+        restore = suspend_triggers_and_indexes(conn, tables)
+        if mode == "replace":
+            school_db.clear_all(conn)
+
+        batches = {table: [] for table in tables}
+        previous_table = None
+        for table, row, position in iter_file_rows(filename):
+            # Insert in file order, so parents go in before their children; a child inserted
+            # first is a pending foreign key violation that every parent insert then has to scan for
+            if table != previous_table:
+                for pending in tables:
+                    if batches[pending]:
+                        conn.executemany(statements[pending], batches[pending])
+                        batches[pending] = []
+                previous_table = table
+            batches[table].append(row)
+            if len(batches[table]) >= IMPORT_BATCH_SIZE:
+                conn.executemany(statements[table], batches[table])
+                batches[table] = []
+                if progress:
+                    progress(position, size)
+        for table in tables:
+            conn.executemany(statements[table], batches[table])
+
+        finish_load(conn, restore)
+        if progress:
+            progress(size, size)
+    finally:
+        conn.execute(f"PRAGMA cache_size = {previous_cache_size}")
+        conn.execute("PRAGMA temp_store = DEFAULT")
+
+
+def finish_load(conn, restore):
+    """ Recreate the suspended triggers and indexes, recompute what they maintain and tell readers to reload
+
+    The capacity trigger was dropped with the others, so the loaded
+    enrollments are checked here; an oversold course fails the load.
+    """
+    for sql in restore:
+        conn.execute(sql)
+    school_db.rebuild_derived(conn)
+    oversold = school_db.oversold_courses(conn)
+    if oversold:
+        raise ValueError("Course is full: " + ", ".join(f"{course_id} ({enrolled} enrolled, capacity {capacity})"
+                                                        for course_id, enrolled, capacity in oversold))
+    conn.executemany("INSERT INTO change_log (entity, entity_id, op) VALUES (?, NULL, 'reload')",
+                     [(table,) for table, _ in school_db.LOGGED_TABLES])
+
+
+def parse_shard(filename):
+    """ Read and check one export file in a pool process; return ({table: [row tuples]}, records, seconds) """
+    started = time.perf_counter()
+    rows = {table: [] for table, _ in EXPORT_TABLES}
+    records = 0
+    for table, row, _ in iter_file_rows(filename):
+        rows[table].append(row)
+        records += 1
+    return rows, records, time.perf_counter() - started
+
+
+def import_files(conn, filenames, mode="append", progress=None, workers=None):
+    """ Load many export files (shards) at once, parsing them in parallel processes
+
+    Each shard is read and checked by parse_shard in a ProcessPoolExecutor
+    while this thread, the only writer, inserts the rows of the shards
+    already parsed, all in one transaction like import_file. Shards are
+    taken in the given order, and a record whose ID (or enrollment pair) an
+    earlier shard already had is skipped and counted as a duplicate.
+    Students and instructors go in as soon as their shard is parsed;
+    courses and enrollments after the last one. Returns one
+    {"file", "records", "inserted", "duplicates", "parse_seconds",
+    "insert_seconds"} report per shard.
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Unknown import mode: {mode}")
+    if not filenames:
+        return []
+    if any(is_snapshot(filename) or is_backup_manifest(filename) for filename in filenames):
+        raise ValueError("Snapshots and backups can only be loaded one at a time")
+    tables = [table for table, _ in EXPORT_TABLES]
+    columns = dict(EXPORT_TABLES)
+    key_columns = dict(school_db.JOURNALED_TABLES)
+    positions = {table: [columns[table].index(key) for key in key_columns[table]] for table in tables}
+    statements = {table: insert_statement(table, columns[table], mode) for table in tables}
+    seen = {table: set() for table in tables}
+    held = {table: [] for table in tables if table not in SHARD_EARLY_TABLES}
+    reports = []
+
+    def unique(report, table, rows):
+        fresh = []
+        for row in rows:
+            key = tuple(row[position] for position in positions[table])
+            if key in seen[table]:
+                report["duplicates"] += 1
+            else:
+                seen[table].add(key)
+                fresh.append(row)
+        report["inserted"] += len(fresh)
+        return fresh
+
+    previous_cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    conn.execute(f"PRAGMA cache_size = {IMPORT_CACHE_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    # spawn: forking a process that runs Qt and open SQLite connections is not safe
+    context = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(workers or min(len(filenames), os.cpu_count() or 1), mp_context=context)
+    try:
+        futures = [pool.submit(parse_shard, filename) for filename in filenames]
+        conn.execute("BEGIN")
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+        restore = suspend_triggers_and_indexes(conn, tables)
+        if mode == "replace":
+            school_db.clear_all(conn)
+        for number, (filename, future) in enumerate(zip(filenames, futures)):
+            rows, records, parse_seconds = future.result()
+            started = time.perf_counter()
+            report = {"file": filename, "records": records, "inserted": 0, "duplicates": 0,
+                      "parse_seconds": round(parse_seconds, 3)}
+            for table in tables:
+                fresh = unique(report, table, rows[table])
+                if table in held:
+                    held[table] += fresh
+                else:
+                    conn.executemany(statements[table], fresh)
+            report["insert_seconds"] = round(time.perf_counter() - started, 3)
+            reports.append(report)
+            if progress:
+                progress(number + 1, len(filenames) + 1)
+        for table in held:
+            conn.executemany(statements[table], held[table])
+        finish_load(conn, restore)
+        if progress:
+            progress(len(filenames) + 1, len(filenames) + 1)
+    finally:
+        # Shards still queued after an error are not parsed
+        pool.shutdown(cancel_futures=True)
+        conn.execute(f"PRAGMA cache_size = {previous_cache_size}")
+        conn.execute("PRAGMA temp_store = DEFAULT")
+    return reports
+
+
+def backup_progress(progress):
+    """ Adapt a progress(done, total) callback to the one Connection.backup calls """
+    if progress is None:
+        return None
+    return lambda status, remaining, total: progress(total - remaining, total)
+
+
+def save_snapshot(conn, filename, progress=None):
+    """ Copy the database page by page into a standalone SQLite file with the backup API
+
+    The copy is taken inside one read transaction, so it is a consistent
+    point-in-time image even while other connections keep writing.
+    """
+    temp_filename = filename + ".part"
+    if os.path.exists(temp_filename):
+        os.remove(temp_filename)
+    conn.execute("BEGIN")
+    conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    target = sqlite3.connect(temp_filename)
+    try:
+        conn.backup(target, pages=SNAPSHOT_PAGES, progress=backup_progress(progress))
+        # The copied header says WAL; a standalone file should not need -wal/-shm files
+        target.execute("PRAGMA journal_mode = DELETE")
+        target.close()
+        os.replace(temp_filename, filename)
+    except BaseException:
+        target.close()
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
+def check_snapshot(filename):
+    """ Raise ValueError unless filename is an SQLite database holding the school tables """
+    with open(filename, "rb") as file:
+        if file.read(16) != b"SQLite format 3\x00":
+            raise ValueError("Invalid snapshot: not an SQLite database")
+    source = sqlite3.connect(f"file:{filename}?mode=ro", uri=True)
+    try:
+        tables = {row[0] for row in source.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        version = source.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        source.close()
+    missing = [table for table, _ in EXPORT_TABLES if table not in tables]
+    if missing:
+        raise ValueError(f"Invalid snapshot: missing {', '.join(missing)}")
+    if version > school_db.SCHEMA_VERSION:
+        raise ValueError("Invalid snapshot: saved by a newer version of the program")
+
+
+def restore_snapshot(conn, filename, mode="replace", progress=None):
+    """ Load a file written by save_snapshot
+
+    replace copies the snapshot's pages over the whole database with the
+    backup API, then upgrades its schema if the snapshot is older. append and
+    upsert attach the snapshot and merge its rows with INSERT ... SELECT.
+    """
+    check_snapshot(filename)
+    if mode == "replace":
+        if conn.in_transaction:
+            conn.commit()
+        source = sqlite3.connect(f"file:{filename}?mode=ro", uri=True)
+        try:
+            source.backup(conn, pages=SNAPSHOT_PAGES, progress=backup_progress(progress))
+        finally:
+            source.close()
+        school_db.create_tables(conn)
+        conn.executemany("INSERT INTO change_log (entity, entity_id, op) VALUES (?, NULL, 'reload')",
+                         [(table,) for table, _ in school_db.LOGGED_TABLES])
+        school_db.mark_journal_reset(conn)
+        return
+
+    conn.execute("ATTACH DATABASE ? AS snapshot", (filename,))
+    try:
+        conn.execute("BEGIN")
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+        for number, (table, columns) in enumerate(EXPORT_TABLES):
+            # Snapshots from older versions lack the columns added since
+            present = {row[1] for row in conn.execute(f"PRAGMA snapshot.table_info({table})")}
+            columns = tuple(column for column in columns if column in present)
+            conn.execute(insert_statement(table, columns, mode, source="snapshot"))
+            if progress:
+                progress(number + 1, len(EXPORT_TABLES))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE snapshot")
+
+
+def is_backup_manifest(filename):
+    return os.path.basename(filename) == BACKUP_MANIFEST
+
+
+def read_manifest(directory):
+    """ The manifest of a backup directory, or None if nothing was backed up there yet """
+    path = os.path.join(directory, BACKUP_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as file:
+        try:
+            manifest = json.load(file)
+        except ValueError:
+            raise ValueError("Invalid backup manifest: not JSON")
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("chain"), list):
+        raise ValueError("Invalid backup manifest: no chain")
+    if manifest.get("format", 0) > BACKUP_FORMAT or manifest.get("schema_version", 0) > school_db.SCHEMA_VERSION:
+        raise ValueError("Invalid backup manifest: written by a newer version of the program")
+    return manifest
+
+
+def write_manifest(directory, manifest):
+    path = os.path.join(directory, BACKUP_MANIFEST)
+    with open(path + ".part", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(path + ".part", path)
+
+
+def journal_changes(conn, after, through):
+    """ Return {table: set of key tuples} from the backup_journal entries after..through
+
+    None means the journal cannot say: its older entries were trimmed, or a
+    table was rewritten without its triggers.
+    """
+    oldest = conn.execute("SELECT MIN(seq) FROM backup_journal").fetchone()[0]
+    if after < through and (oldest is None or oldest > after + 1):
+        return None
+    key_columns = dict(school_db.JOURNALED_TABLES)
+    changes = {table: set() for table in key_columns}
+    for table, key1, key2 in conn.execute("SELECT entity, key1, key2 FROM backup_journal WHERE seq > ? AND seq <= ?",
+                                          (after, through)):
+        if key1 is None:
+            return None
+        changes[table].add((key1, key2)[:len(key_columns[table])])
+    return changes
+
+
+def write_delta(conn, filename, changes):
+    """ Write the current rows for the changed keys, or a "deleted" record for the keys that are gone """
+    key_columns = dict(school_db.JOURNALED_TABLES)
+    written = 0
+    temp_filename = filename + ".part"
+    try:
+        with open_text(temp_filename, "w", True) as file:
+            for table, columns in EXPORT_TABLES:
+                keys = key_columns[table]
+                positions = [columns.index(key) for key in keys]
+                pending = sorted(changes[table])
+                row_value = "(" + ", ".join("?" * len(keys)) + ")"
+                for start in range(0, len(pending), BACKUP_CHUNK_SIZE):
+                    chunk = pending[start:start + BACKUP_CHUNK_SIZE]
+                    found = set()
+                    for row in conn.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE ({', '.join(keys)}) "
+                                            f"IN (VALUES {', '.join([row_value] * len(chunk))})",
+                                            [value for key in chunk for value in key]):
+                        found.add(tuple(row[position] for position in positions))
+                        file.write(json.dumps({"table": table, **dict(zip(columns, row))}) + "\n")
+                    file.writelines(json.dumps({"table": table, "deleted": True, **dict(zip(keys, key))}) + "\n"
+                                    for key in chunk if key not in found)
+                written += len(pending)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+    return written
+
+
+def backup(conn, directory, progress=None):
+    """ Back the database up into directory, writing only what changed since the previous backup there
+
+    backup_journal lists the keys written since then; their current rows go
+    to a delta file, with {"table": ..., "deleted": true, key columns} for
+    the ones deleted since. The first backup, and any the journal can no
+    longer bring up to date (it was trimmed, the tables were reloaded, or
+    the directory holds another database's backups), is a full export that
+    starts a new chain in the manifest. Everything is read in one
+    transaction. Returns (kind, filename, records) with kind "full" or
+    "delta", or (None, None, 0) when nothing changed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    conn.execute("BEGIN")
+    through = school_db.last_journal_seq(conn)
+    source = school_db.database_id(conn)
+    changes = None
+    if manifest and manifest["chain"] and manifest.get("database_id") == source:
+        after = manifest["chain"][-1]["through_seq"]
+        if after <= through:
+            changes = journal_changes(conn, after, through)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+
+    if changes is None:
+        kind = "full"
+        filename = f"full-{stamp}-{through}{BACKUP_EXTENSION}"
+        export_file(conn, os.path.join(directory, filename), progress)
+        records = conn.execute("SELECT SUM(total) FROM table_totals").fetchone()[0]
+        manifest = {"format": BACKUP_FORMAT, "database_id": source, "schema_version": school_db.SCHEMA_VERSION,
+                    "chain": []}
+        entry = {"kind": kind, "file": filename, "through_seq": through}
+    elif not any(changes.values()):
+        return None, None, 0
+    else:
+        kind = "delta"
+        filename = f"delta-{stamp}-{through}{BACKUP_EXTENSION}"
+        records = write_delta(conn, os.path.join(directory, filename), changes)
+        entry = {"kind": kind, "file": filename, "after_seq": after, "through_seq": through}
+    entry.update(time=time.strftime("%Y-%m-%dT%H:%M:%S"), records=records)
+    manifest["chain"].append(entry)
+    manifest["schema_version"] = school_db.SCHEMA_VERSION
+    write_manifest(directory, manifest)
+    if progress:
+        progress(1, 1)
+    return kind, filename, records
+
+
+def restore_backup(conn, manifest_filename, progress=None):
+    """ Load the chain of a backup manifest: its full export, then every delta after it
+
+    The deltas are merged first, keeping only the last state of each key,
+    so a row changed in many deltas is written once. The full export is
+    loaded by import_file in replace mode, and the merged changes are
+    applied in the same transaction: deletions children first, then the
+    remaining rows parents first as upserts.
+    """
+    directory = os.path.dirname(manifest_filename)
+    manifest = read_manifest(directory)
+    if manifest is None or not manifest["chain"] or manifest["chain"][0].get("kind") != "full":
+        raise ValueError("Invalid backup manifest: the chain does not start with a full backup")
+    latest = {table: {} for table in KEY_COLUMNS}
+    for entry in manifest["chain"][1:]:
+        with open_text(os.path.join(directory, entry["file"]), "r") as file:
+            for table, record in iter_file_records(file, True, entry["file"]):
+                key = record_key(table, record, entry["file"])
+                latest[table][key] = None if record.get("deleted") else record_row(table, record, entry["file"])
+
+    import_file(conn, os.path.join(directory, manifest["chain"][0]["file"]), "replace", progress)
+    for table, keys in reversed(school_db.JOURNALED_TABLES):
+        conn.executemany(f"DELETE FROM {table} WHERE {' AND '.join(f'{key} = ?' for key in keys)}",
+                         [key for key, row in latest[table].items() if row is None])
+    for table, columns in EXPORT_TABLES:
+        conn.executemany(insert_statement(table, columns, "upsert"),
+                         [row for row in latest[table].values() if row is not None])
+
+
+def iter_student_rows(file, json_lines):
+    """ Yield a (student_id, name, age, email, course_ids) tuple, or an error message, per row of a student list
+
+    CSV lists need a header naming STUDENT_COLUMNS and separate course IDs
+    with semicolons; JSON Lines records may give course_ids as a list.
+    """
+    if json_lines:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield "Malformed JSON"
+                continue
+            if not isinstance(record, dict):
+                yield "Expected a JSON object"
+                continue
+            course_ids = record.get("course_ids")
+            if isinstance(course_ids, str):
+                course_ids = course_ids.split(";")
+            yield tuple(record.get(column) for column in STUDENT_COLUMNS[:-1]) + (course_ids,)
+    else:
+        reader = csv.DictReader(file)
+        missing = [column for column in STUDENT_COLUMNS if column not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"Invalid student list: missing columns {', '.join(missing)}")
+        for record in reader:
+            yield tuple(record[column] for column in STUDENT_COLUMNS[:-1]) + ((record["course_ids"] or "").split(";"),)
+
+
+def register_students_file(conn, filename, progress=None):
+    """ Register every student in a CSV or JSON Lines list in one transaction
+
+    Rows go to school_db.register_students in batches; rejected rows are
+    skipped and reported as (row number, error) without stopping the load.
+    Returns the number of students registered and the errors. Any exception
+    rolls back the whole load, including the dropped search trigger.
+    """
+    size = os.path.getsize(filename)
+    registered = 0
+    errors = []
+    batch = []
+    numbers = []
+
+    # Index the new students in one statement at the end rather than through the trigger row by row
+    if not conn.in_transaction:
+        # IMMEDIATE: take the write lock now, before the reads, like school_db.immediate
+        conn.execute("BEGIN IMMEDIATE")
+    last_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM students").fetchone()[0]
+    trigger_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'students_fts_ai'").fetchone()
+    conn.execute("DROP TRIGGER IF EXISTS students_fts_ai")
+
+    def flush():
+        nonlocal registered
+        count, batch_errors = school_db.register_students(conn, batch, first_row=0)
+        registered += count
+        errors.extend((numbers[index], message) for index, message in batch_errors)
+        batch.clear()
+        numbers.clear()
+
+    with open(filename, "rb") as raw:
+        stream = gzip.GzipFile(fileobj=raw) if filename.endswith(".gz") else raw
+        with io.TextIOWrapper(stream, encoding="utf-8", newline="") as file:
+            for number, row in enumerate(iter_student_rows(file, is_json_lines(filename)), 1):
+                if isinstance(row, str):
+                    errors.append((number, row))
+                    continue
+                batch.append(row)
+                numbers.append(number)
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    flush()
+                    if progress:
+                        progress(raw.tell(), size)
+    flush()
+    school_db.index_rows_after(conn, "students", last_rowid)
+    if trigger_sql:
+        conn.execute(trigger_sql[0])
+    if progress:
+        progress(size, size)
+    return registered, errors
@@ -0,0 +1,100 @@
+import queue
+import threading
+from concurrent.futures import Future, CancelledError
+
+import school_db
+from connection_pool import ConnectionPool
+
+# How many SQLite VM instructions run between two cancellation checks
+PROGRESS_STEPS = 1000
+
+
+class DbFuture(Future):
+    """ Future that can also abort a request that is already running """
+
+    def __init__(self):
+        super().__init__()
+        self.abort_requested = False
+
+    def cancel(self):
+        self.abort_requested = True
+        return super().cancel()
+
+
+class DatabaseWorker:
+    """ Runs database requests on a single writer thread and a pool of reader threads
+
+    Every request is a function called as fn(conn, *args, **kwargs) on a
+    connection borrowed from the pool for that request: a read-only one for
+    reads, the pool's writer for writes. Writes are committed when the
+    function returns and rolled back when it raises. Submitting returns a
+    DbFuture; calling cancel() on it aborts the request even mid-query.
+    """
+
+    def __init__(self, path=school_db.DB_PATH, readers=2, pool=None):
+        self.owns_pool = pool is None
+        self.pool = ConnectionPool(path) if pool is None else pool
+        self.write_queue = queue.Queue()
+        self.read_queue = queue.Queue()
+        self.threads = [threading.Thread(target=self._run, args=(self.write_queue, self.pool.writer), daemon=True)]
+        for _ in range(readers):
+            self.threads.append(threading.Thread(target=self._run, args=(self.read_queue, self.pool.reader), daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def submit_read(self, fn, *args, progress=None, **kwargs):
+        return self._submit(self.read_queue, fn, args, kwargs, progress)
+
+    def submit_write(self, fn, *args, progress=None, **kwargs):
+        return self._submit(self.write_queue, fn, args, kwargs, progress)
+
+    def close(self):
+        """ Stop every worker thread once the queued requests are done """
+        self.write_queue.put(None)
+        for _ in self.threads[1:]:
+            self.read_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.owns_pool:
+            self.pool.close()
+
+    def _submit(self, request_queue, fn, args, kwargs, progress):
+        future = DbFuture()
+        request_queue.put((future, fn, args, kwargs, progress))
+        return future
+
+    def _run(self, request_queue, borrow):
+        while True:
+            request = request_queue.get()
+            if request is None:
+                break
+            future, fn, args, kwargs, progress = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with borrow() as conn:
+                    conn.set_progress_handler(lambda: future.abort_requested, PROGRESS_STEPS)
+                    try:
+                        if progress is not None:
+                            kwargs["progress"] = self._progress_reporter(future, progress)
+                        result = fn(conn, *args, **kwargs)
+                        conn.commit()
+                    except BaseException:
+                        conn.rollback()
+                        raise
+                    finally:
+                        conn.set_progress_handler(None, 0)
+            except BaseException as e:
+                if future.abort_requested:
+                    e = CancelledError()
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def _progress_reporter(future, progress):
+        def report(done, total):
+            if future.abort_requested:
+                raise CancelledError()
+            progress(done, total)
+        return report
@@ -0,0 +1,181 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+import school_db
+
+
+class Student:
+    __slots__ = ("student_id", "name", "age", "email")
+
+    def __init__(self, student_id, name, age, email):
+        self.student_id = student_id
+        self.name = name
+        self.age = age
+        self.email = email
+
+    def row(self):
+        return (self.student_id, self.name)
+
+
+class Instructor:
+    __slots__ = ("instructor_id", "name", "age", "email")
+
+    def __init__(self, instructor_id, name, age, email):
+        self.instructor_id = instructor_id
+        self.name = name
+        self.age = age
+        self.email = email
+
+    def row(self):
+        return (self.instructor_id, self.name)
+
+
+class Course:
+    __slots__ = ("course_id", "course_name", "instructor_id")
+
+    def __init__(self, course_id, course_name, instructor_id):
+        self.course_id = course_id
+        self.course_name = course_name
+        self.instructor_id = instructor_id
+
+    def row(self):
+        return (self.course_id, self.course_name, self.instructor_id)
+
+
+# category -> (table, key column, record class); the record's fields are the table's columns
+CACHED_TABLES = {
+    "Students": ("students", "student_id", Student),
+    "Instructors": ("instructors", "instructor_id", Instructor),
+    "Courses": ("courses", "course_id", Course),
+}
+
+
+class EntityCache:
+    """ In-memory copy of the students, instructors and courses tables, keyed by ID
+
+    sync() must run on a connection that only this process writes through
+    (the DatabaseWorker writer). It applies the change_log entries written
+    since the last sync by re-reading just the touched rows. After the
+    first load, a sync that is not told about a commit of its own only
+    reads PRAGMA data_version, which moves when another connection or
+    process commits. Readers on any thread use the list_* methods, which
+    mirror the keyset paging functions of school_db without a connection.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.records = {category: {} for category in CACHED_TABLES}
+        self.keys = {category: [] for category in CACHED_TABLES}
+        self.versions = {category: 0 for category in CACHED_TABLES}
+        self.last_seq = None
+        self.data_version = None
+        # False until the first sync has read every table
+        self.loaded = False
+
+    def sync(self, conn, own_commit=False):
+        """ Bring the cache up to date; return the set of categories that changed """
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if self.last_seq is not None and not own_commit and data_version == self.data_version:
+            return set()
+        self.data_version = data_version
+
+        if self.last_seq is None:
+            newest = school_db.last_change(conn)
+            for category in CACHED_TABLES:
+                self.reload(conn, category)
+            # Set only once every table is read, so a failed first load is retried in full
+            self.last_seq = newest
+            self.loaded = True
+            return set(CACHED_TABLES)
+
+        newest = school_db.last_change(conn)
+        oldest = conn.execute("SELECT MIN(seq) FROM change_log").fetchone()[0]
+        if newest < self.last_seq or (oldest is not None and oldest > self.last_seq + 1):
+            self.last_seq = newest
+            for category in CACHED_TABLES:
+                self.reload(conn, category)
+            return set(CACHED_TABLES)
+
+        touched = {}
+        for entity, entity_id in conn.execute("SELECT entity, entity_id FROM change_log WHERE seq > ? AND seq <= ?",
+                                              (self.last_seq, newest)):
+            touched.setdefault(entity, set()).add(entity_id)
+        self.last_seq = newest
+
+        changed = set()
+        for category, (table, key, record_class) in CACHED_TABLES.items():
+            ids = touched.get(table)
+            if not ids:
+                continue
+            changed.add(category)
+            # Bulk loads log a single NULL id meaning "reload the table"
+            if None in ids:
+                self.reload(conn, category)
+            else:
+                self.update(conn, category, list(ids))
+        return changed
+
+    def reload(self, conn, category):
+        table, key, record_class = CACHED_TABLES[category]
+        records = {}
+        for row in conn.execute(f"SELECT {', '.join(record_class.__slots__)} FROM {table}"):
+            if row[0] is not None:
+                records[row[0]] = record_class(*row)
+        with self.lock:
+            self.records[category] = records
+            self.keys[category] = sorted(records)
+            self.versions[category] += 1
+
+    def update(self, conn, category, ids):
+        table, key, record_class = CACHED_TABLES[category]
+        current = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            for row in conn.execute(f"SELECT {', '.join(record_class.__slots__)} FROM {table} "
+                                    f"WHERE {key} IN ({', '.join('?' * len(chunk))})", chunk):
+                current[row[0]] = record_class(*row)
+        with self.lock:
+            records, keys = self.records[category], self.keys[category]
+            for entity_id in ids:
+                if entity_id in current:
+                    if entity_id not in records:
+                        insort(keys, entity_id)
+                    records[entity_id] = current[entity_id]
+                elif entity_id in records:
+                    del records[entity_id]
+                    del keys[bisect_left(keys, entity_id)]
+            self.versions[category] += 1
+
+    def get(self, category, key):
+        with self.lock:
+            return self.records[category].get(key)
+
+    def list_page(self, category, after_key=None, limit=200):
+        with self.lock:
+            keys = self.keys[category]
+            start = 0 if after_key is None else bisect_right(keys, after_key)
+            return self.rows(category, keys[start:start + limit])
+
+    def list_window(self, category, first_key, limit):
+        with self.lock:
+            keys = self.keys[category]
+            start = bisect_left(keys, first_key)
+            return self.rows(category, keys[start:start + limit])
+
+    def list_page_before(self, category, before_key=None, limit=200):
+        with self.lock:
+            keys = self.keys[category]
+            end = len(keys) if before_key is None else bisect_left(keys, before_key)
+            return self.rows(category, keys[max(end - limit, 0):end])
+
+    def list_at(self, category, offset, limit):
+        with self.lock:
+            return self.rows(category, self.keys[category][offset:offset + limit])
+
+    def count_records(self, category):
+        with self.lock:
+            return len(self.keys[category])
+
+    def rows(self, category, keys):
+        records = self.records[category]
+        return [records[key].row() for key in keys]
@@ -1,19 +1,188 @@
+import time
+# Startup phases are timed from here, before the toolkits are imported
+STARTED = time.perf_counter()
 import threading
 import sys
-import json
+import os
 import sqlite3
+from concurrent.futures import CancelledError
 from PyQt5 import QtWidgets, QtGui
-from PyQt5.QtWidgets import QMessageBox, QListWidget, QVBoxLayout, QLabel, QLineEdit, QComboBox, QPushButton, QFormLayout, QHBoxLayout, QGridLayout, QFileDialog, QFrame, QWidget
-from PyQt5.QtGui import QWindow
+from PyQt5.QtWidgets import QMessageBox, QListView, QVBoxLayout, QLabel, QLineEdit, QComboBox, QPushButton, QFormLayout, QHBoxLayout, QGridLayout, QFileDialog, QFrame, QProgressBar, QInputDialog, QCheckBox
 from PyQt5 import QtCore
-from tkinter_display import create_tkinter_frame, update_display
-from tkinter import TclError
+import school_db
+import data_transfer
+from db_worker import DatabaseWorker
+from connection_pool import ConnectionPool
+from search_cache import SearchCache
+from entity_cache import EntityCache
+from roster_index import RosterIndex, ROSTER_CRITERIA
+from write_buffer import WriteBuffer, FLUSH_MS, FLUSH_SIZE
+from qt_models import KeysetListModel, SearchResultModel, KeyRole
+from query_metrics import QueryMetrics, SLICE_SECONDS, SLICES, SLOW_QUERY_SUFFIX
+
+# Records shown per search page before "Load More" is needed
+SEARCH_PAGE_SIZE = 100
+# Typing pause before a live search is started
+SEARCH_DEBOUNCE_MS = 250
+# How often the record cache checks for commits made outside this window
+CACHE_SYNC_MS = 1000
+# How often an open diagnostics window redraws, and how many statements it lists
+DIAGNOSTICS_REFRESH_MS = 1000
+DIAGNOSTICS_STATEMENTS = 25
+# Rejected rows listed after a bulk registration or a flush of queued writes; the rest are only counted
+REPORTED_ERRORS = 20
+# Load dialog choices and the data_transfer.import_file mode they select
+LOAD_MODES = {"Replace all records": "replace", "Append new records": "append", "Update existing records": "upsert"}
+# Startup phases in the order they complete; the report is printed once the last one is reached
+# (or when the Tk display cannot start)
+STARTUP_PHASES = ("imports", "window built", "first paint", "tables ready", "records loaded", "Tk display")
+
+class DatabaseBridge(QtCore.QObject):
+    """ Delivers DatabaseWorker results and progress back on the Qt GUI thread """
+    invoked = QtCore.pyqtSignal(object, object)
+    progressed = QtCore.pyqtSignal(int, int)
 
-class SchoolManagementApp(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
-        self.conn = sqlite3.connect('school_management.db')
-        self.create_tables()
+        self.invoked.connect(self.deliver)
+
+    def deliver(self, callback, value):
+        callback(value)
+
+    def call(self, callback, value):
+        """ Call callback(value) on the GUI thread, from any thread """
+        self.invoked.emit(callback, value)
+
+    def watch(self, future, callback):
+        future.add_done_callback(lambda f: self.call(callback, f))
+
+    def report_progress(self, done, total):
+        self.progressed.emit(done, total)
+
+class StartupReport:
+    """ Milliseconds from process start to each startup phase, also recorded as "startup: <phase>" actions """
+
+    def __init__(self, metrics, started=STARTED):
+        self.metrics = metrics
+        self.started = started
+        self.phases = {}
+
+    def mark(self, phase):
+        if phase in self.phases:
+            return
+        seconds = time.perf_counter() - self.started
+        self.phases[phase] = round(seconds * 1000, 1)
+        self.metrics.record_action(f"startup: {phase}", seconds)
+        if phase == STARTUP_PHASES[-1]:
+            self.report()
+
+    def report(self, note=None):
+        phases = [f"{name} {ms:g} ms" for name, ms in self.phases.items()]
+        print("Startup: " + ", ".join(phases + ([note] if note else [])))
+
+class DiagnosticsPanel(QtWidgets.QWidget):
+    """ Window with the latency histograms and slow queries of a QueryMetrics, refreshed while it is open """
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+        self.setWindowTitle("Diagnostics")
+        self.resize(900, 600)
+
+        layout = QVBoxLayout(self)
+        self.text = QtWidgets.QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        self.text.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        layout.addWidget(self.text)
+
+        save_button = QPushButton("Save Metrics as JSON")
+        save_button.clicked.connect(self.save)
+        layout.addWidget(save_button)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(DIAGNOSTICS_REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        snapshot = self.metrics.snapshot()
+        header = f"{'count':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>9}  (ms, last {SLICE_SECONDS * SLICES // 60} min)"
+
+        def row(name, stats):
+            values = [stats[key] for key in ("p50_ms", "p90_ms", "p99_ms", "max_ms")]
+            return f"{stats['recent_count']:>7} " + " ".join(
+                f"{value:>8g}" if value is not None else f"{'-':>8}" for value in values) + f"  {name}"
+
+        lines = ["UI actions", header]
+        lines += [row(name, stats) for name, stats in snapshot["actions"].items()]
+        lines += ["", f"Statements by total time (top {DIAGNOSTICS_STATEMENTS})", header]
+        lines += [row(key, stats) for key, stats in list(snapshot["statements"].items())[:DIAGNOSTICS_STATEMENTS]]
+        lines += ["", f"Slow queries (over {self.metrics.slow_ms} ms, newest first, also in {self.metrics.slow_log})"]
+        for entry in reversed(snapshot["slow_queries"]):
+            lines.append(f"{entry['time']}  {entry['ms']:.1f} ms  {entry['sql']}")
+            lines += [f"    {detail}" for _, _, detail in entry["plan"]]
+        self.text.setPlainText("\n".join(lines))
+
+    def save(self):
+        filename, _ = QFileDialog.getSaveFileName(self, "Save Metrics", "metrics.json", "JSON Files (*.json)")
+        if filename:
+            try:
+                self.metrics.dump(filename)
+            except OSError as e:
+                QMessageBox.warning(self, "Error", f"Failed to save metrics: {e}")
+
+
+class SchoolManagementApp(QtWidgets.QWidget):
+    """ The main window; it paints first and reads the database afterwards
+
+    Forms are built empty. Once the window has painted, the tables are
+    created on the worker, the lists fetch their first page from SQLite
+    when they come into view, and the record cache loads in the
+    background; the widgets switch to the cache, and the Tkinter display
+    is launched, when that load is done.
+    """
+
+    def __init__(self, started=STARTED):
+        super().__init__()
+        self.metrics = QueryMetrics(slow_log=school_db.DB_PATH + SLOW_QUERY_SUFFIX)
+        self.startup = StartupReport(self.metrics, started)
+        self.startup.mark("imports")
+        self.pool = ConnectionPool(metrics=self.metrics)
+        self.diagnostics = None
+        self.db = DatabaseWorker(pool=self.pool)
+        self.bridge = DatabaseBridge()
+        self.long_task = None
+        self.search_future = None
+        self.search_token = None
+        self.search_cache = SearchCache()
+        # Enrollment bitsets for "Roster query" searches, patched on the reader threads before each query
+        self.roster = RosterIndex()
+        self.cache = EntityCache()
+        # Form submissions queued in write-behind mode, and the flush writing them
+        self.write_buffer = WriteBuffer(self.cache, self.pool.path)
+        self.flush_future = None
+        # The last cache sync queued on the writer
+        self.sync_future = None
+        self.tables_ready = False
+        self.tkinter_thread = None
+
+        # Pick up commits made by other connections or processes, once the tables exist
+        self.sync_timer = QtCore.QTimer(self)
+        self.sync_timer.setInterval(CACHE_SYNC_MS)
+        self.sync_timer.timeout.connect(self.sync_cache)
+        self.flush_timer = QtCore.QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(FLUSH_MS)
+        self.flush_timer.timeout.connect(self.flush_writes)
 
         self.setWindowTitle("School Management System")
         self.setGeometry(100, 100, 1200, 600)
@@ -30,47 +199,178 @@ class SchoolManagementApp(QtWidgets.QWidget):
         self.embed_tkinter_display()
 
         self.setLayout(self.main_layout)
+        self.startup.mark("window built")
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if "first paint" not in self.startup.phases:
+            self.startup.mark("first paint")
+            # Start on the database only after this paint has reached the screen
+            QtCore.QTimer.singleShot(0, self.create_tables)
 
     def create_tables(self):
-        self.conn.execute("PRAGMA foreign_keys = ON")
+        # Its commit is followed by the first cache sync, which loads every record (see written)
+        self.run_write(school_db.create_tables, on_success=self.show_tables, error_prefix="Error creating tables")
+
+    def show_tables(self, _):
+        """ Let the forms read their first rows, from SQLite until the record cache has loaded """
+        self.tables_ready = True
+        self.startup.mark("tables ready")
+        self.sync_timer.start()
+        # Submissions left in the queue file by a crash
+        self.flush_writes()
+        self.update_course_listbox()
+        self.update_instructor_combobox()
+        self.update_record_listbox()
+
+    def sync_cache(self, own_commit=False):
+        """ Queue a cache sync, unless this is a timer tick and the last sync is still waiting for the writer """
+        # A sync after our own commit always goes ahead: data_version does not show it to an earlier one
+        if not own_commit and self.sync_future is not None and not self.sync_future.done():
+            return
+        self.sync_future = self.run_write(self.cache.sync, own_commit, on_success=self.refresh_cached_widgets)
+
+    def refresh_cached_widgets(self, changed):
+        """ Redraw the widgets that show a category the last sync changed """
+        if not changed:
+            return
+        if self.tkinter_thread is None and self.cache.loaded:
+            self.startup.mark("records loaded")
+            self.start_tkinter_display()
+            # Build the roster bitsets now, so the first roster query does not wait for them
+            self.run_read(self.roster.sync)
+        self.search_cache.clear()
+        # A new student changes enrollment counts, but reloading would drop the courses being picked
+        if "Courses" in changed or ("Students" in changed and not self.course_listbox.selectionModel().hasSelection()):
+            self.update_course_listbox()
+        if "Instructors" in changed:
+            self.update_instructor_combobox()
+        if self.records.category in changed:
+            self.records.refresh()
+
+    def fetch_cached_page(self, category, after_key, limit, on_rows):
+        if self.cache.loaded:
+            on_rows(self.cache.list_page(category, after_key, limit))
+        else:
+            self.run_read(school_db.list_page, category, after_key, limit, on_success=on_rows)
+
+    def run_read(self, fn, *args, on_success=None, error_prefix=None, **kwargs):
+        future = self.db.submit_read(fn, *args, **kwargs)
+        self.time_action(fn, future)
+        self.bridge.watch(future, lambda f: self.handle_result(f, on_success, error_prefix))
+        return future
+
+    def run_write(self, fn, *args, on_success=None, error_prefix=None, **kwargs):
+        future = self.db.submit_write(fn, *args, **kwargs)
+        self.time_action(fn, future)
+        if fn != self.cache.sync:
+            self.bridge.watch(future, lambda f: self.written(f))
+        self.bridge.watch(future, lambda f: self.handle_result(f, on_success, error_prefix))
+        return future
+
+    def time_action(self, fn, future):
+        """ Record the time from the request to its result reaching the GUI thread """
+        started = time.perf_counter()
+        self.bridge.watch(future, lambda f: self.metrics.record_action(fn.__name__, time.perf_counter() - started))
+
+    def written(self, future):
+        self.search_cache.clear()
+        if not future.cancelled() and future.exception() is None:
+            self.sync_cache(own_commit=True)
+
+    def handle_result(self, future, on_success, error_prefix):
+        """ Runs on the GUI thread once a database request has finished """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS students (
-                student_id TEXT PRIMARY KEY,
-                name TEXT,
-                age INTEGER,
-                email TEXT
-            )
-            ''')
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS instructors (
-                instructor_id TEXT PRIMARY KEY,
-                name TEXT,
-                age INTEGER,
-                email TEXT
-            )
-            ''')
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS courses (
-                course_id TEXT PRIMARY KEY,
-                course_name TEXT,
-                instructor_id TEXT,
-                FOREIGN KEY (instructor_id) REFERENCES instructors(instructor_id)
-            )
-            ''')
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS enrollments (
-                student_id TEXT,
-                course_id TEXT,
-                FOREIGN KEY (student_id) REFERENCES students(student_id),
-                FOREIGN KEY (course_id) REFERENCES courses(course_id),
-                PRIMARY KEY (student_id, course_id)
-            )
-            ''')
-            self.conn.commit()
-        except sqlite3.Error as e:
-            print(f"Error creating tables: {e}")
+            result = future.result()
+        except CancelledError:
+            return
+        except ValueError as e:
+            self.show_message("Error", str(e))
+            return
+        except (sqlite3.Error, OSError) as e:
+            self.show_message("Error", f"{error_prefix}: {e}" if error_prefix else str(e))
+            return
+        if on_success:
+            on_success(result)
+
+    def submit_form(self, kind, values, message, clear_form, error_prefix):
+        """ Write a form submission now, or in write-behind mode check it, queue it and clear the form """
+        if not self.write_behind.isChecked():
+            def written(_):
+                self.show_message("Success", message)
+                clear_form()
+
+            self.run_write(school_db.SUBMISSIONS[kind][1], *values, on_success=written, error_prefix=error_prefix)
+            return
+        try:
+            queued = self.write_buffer.add(kind, *values)
+        except ValueError as e:
+            self.show_message("Error", str(e))
+            return
+        clear_form()
+        self.update_pending_writes()
+        if queued >= FLUSH_SIZE:
+            self.flush_writes()
+        elif not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush_writes(self):
+        """ Write every queued submission in one transaction, unless a flush is already running """
+        if self.flush_future is not None or not self.tables_ready or not self.write_buffer.count():
+            return
+        self.flush_timer.stop()
+        submissions, replayed = self.write_buffer.take()
+        self.flush_future = self.run_write(school_db.apply_submissions, submissions, replayed,
+                                           on_success=lambda errors: self.report_rejected(submissions, errors),
+                                           error_prefix="Failed to write the queued submissions")
+        self.bridge.watch(self.flush_future, self.finish_flush)
+
+    def finish_flush(self, future):
+        if future is not self.flush_future:
+            # Already settled by closeEvent
+            return
+        committed = not future.cancelled() and future.exception() is None
+        self.write_buffer.flushed(committed)
+        self.flush_future = None
+        self.update_pending_writes()
+        # What was queued during the flush goes in the next one; a failed flush waits for the next submission
+        if committed and self.write_buffer.count():
+            self.flush_timer.start()
+
+    def report_rejected(self, submissions, errors):
+        if errors:
+            message = f"{len(errors)} queued submissions were rejected:\n"
+            message += "\n".join(f"{submissions[index][0].capitalize()} {submissions[index][1][0]}: {error}"
+                                  for index, error in errors[:REPORTED_ERRORS])
+            if len(errors) > REPORTED_ERRORS:
+                message += f"\n... and {len(errors) - REPORTED_ERRORS} more"
+            self.show_message("Error", message)
+
+    def update_pending_writes(self):
+        count = self.write_buffer.count()
+        self.pending_label.setText(f"Pending writes: {count}" if count else "No pending writes")
+
+    def closeEvent(self, event):
+        if self.diagnostics is not None:
+            self.diagnostics.close()
+        # Write what is still queued before the worker stops; whatever fails stays in the queue file
+        try:
+            if self.flush_future is not None:
+                future, self.flush_future = self.flush_future, None
+                self.write_buffer.flushed(future.exception() is None)
+            if self.tables_ready and self.write_buffer.count():
+                submissions, replayed = self.write_buffer.take()
+                errors = self.db.submit_write(school_db.apply_submissions, submissions, replayed).result()
+                self.write_buffer.flushed(True)
+                for index, error in errors:
+                    kind, values = submissions[index]
+                    print(f"Rejected queued {kind} {values[0]}: {error}")
+        except (sqlite3.Error, CancelledError) as e:
+            print(f"Error writing the queued submissions: {e}")
+        self.write_buffer.close()
+        self.db.close()
+        self.pool.close()
+        super().closeEvent(event)
 
     def embed_tkinter_display(self):
         self.tk_container = QFrame(self)
@@ -78,17 +378,26 @@ class SchoolManagementApp(QtWidgets.QWidget):
         self.tk_container.setLayout(self.tk_container_layout)
         self.main_layout.addWidget(self.tk_container, 1, 2, 4, 1)
 
+    def start_tkinter_display(self):
+        """ Launch the Tkinter window on its own thread, once the record cache it reads has loaded """
+        # Imported here so Tk costs nothing before the Qt window is up
+        from tkinter import TclError
+        from tkinter_display import create_tkinter_frame
+
         def run_tkinter():
-            root, listboxes = create_tkinter_frame()
             try:
-                update_display(listboxes)
+                root, display = create_tkinter_frame(self.cache, self.pool)
+                display.reload()
+                self.bridge.call(self.startup.mark, "Tk display")
+                display.start()
                 root.mainloop()
             except TclError as e:
                 print(f"Error with Tkinter: {e}")
+                self.bridge.call(self.startup.report, "no Tk display")
 
-        tkinter_thread = threading.Thread(target=run_tkinter)
-        tkinter_thread.daemon = True
-        tkinter_thread.start()
+        self.tkinter_thread = threading.Thread(target=run_tkinter)
+        self.tkinter_thread.daemon = True
+        self.tkinter_thread.start()
 
     def create_search_frame(self):
         search_frame = QtWidgets.QWidget()
@@ -101,64 +410,113 @@ class SchoolManagementApp(QtWidgets.QWidget):
         search_layout.addWidget(self.search_entry)
 
         self.search_criteria = QComboBox()
-        self.search_criteria.addItems(["Select Criteria", "Name", "ID", "Course"])
+        self.search_criteria.addItems(["Select Criteria", *school_db.SEARCH_CRITERIA, ROSTER_CRITERIA])
         search_layout.addWidget(self.search_criteria)
 
-        self.search_listbox = QListWidget()
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.live_search)
+        self.search_entry.textEdited.connect(self.schedule_search)
+        self.search_criteria.currentIndexChanged.connect(self.schedule_search)
+
+        self.search_results = SearchResultModel(self)
+        self.search_results.request_more = self.fetch_search_page
+        self.search_listbox = QListView()
+        self.search_listbox.setModel(self.search_results)
         search_layout.addWidget(self.search_listbox)
 
         search_button = QPushButton("Search", self)
         search_button.clicked.connect(self.perform_search)
         search_layout.addWidget(search_button)
 
+        self.load_more_button = QPushButton("Load More", self)
+        self.load_more_button.clicked.connect(lambda: self.search_results.fetchMore())
+        self.load_more_button.hide()
+        search_layout.addWidget(self.load_more_button)
+
         search_frame.setLayout(search_layout)
         self.main_layout.addWidget(search_frame, 0, 0, 1, 2)
 
+    def schedule_search(self):
+        """ Restart the debounce timer and drop the search that is now stale """
+        if self.search_future:
+            self.search_future.cancel()
+            self.search_future = None
+        self.search_token = None
+        self.search_timer.start()
+
+    def live_search(self):
+        # Roster queries wait for the Search button; half-typed ones are not valid expressions
+        if self.search_criteria.currentText() in school_db.SEARCH_CRITERIA:
+            self.perform_search()
+
     def perform_search(self):
-        query = self.search_entry.text().lower()
+        self.search_timer.stop()
         criteria = self.search_criteria.currentText()
-        cursor = self.conn.cursor()
-
-        search_results = []
-        if criteria == "Name":
-            cursor.execute("SELECT * FROM students WHERE LOWER(name) LIKE ?", ('%' + query + '%',))
-            students = cursor.fetchall()
-            search_results += [f"Student: {s[1]}, ID: {s[0]}" for s in students]
-
-            cursor.execute("SELECT * FROM instructors WHERE LOWER(name) LIKE ?", ('%' + query + '%',))
-            instructors = cursor.fetchall()
-            search_results += [f"Instructor: {i[1]}, ID: {i[0]}" for i in instructors]
-
-        elif criteria == "ID":
-            cursor.execute("SELECT * FROM students WHERE LOWER(student_id) LIKE ?", ('%' + query + '%',))
-            students = cursor.fetchall()
-            search_results += [f"Student: {s[1]}, ID: {s[0]}" for s in students]
-
-            cursor.execute("SELECT * FROM instructors WHERE LOWER(instructor_id) LIKE ?", ('%' + query + '%',))
-            instructors = cursor.fetchall()
-            search_results += [f"Instructor: {i[1]}, ID: {i[0]}" for i in instructors]
-
-        elif criteria == "Course":
-            cursor.execute("SELECT * FROM courses WHERE LOWER(course_name) LIKE ? OR LOWER(course_id) LIKE ?",
-                           ('%' + query + '%', '%' + query + '%'))
-            courses = cursor.fetchall()
-            for course in courses:
-                course_info = f"Course: {course[1]} (ID: {course[0]}), Instructor: {course[2]}"
-                search_results.append(course_info)
-
-                cursor.execute("SELECT s.name, s.student_id FROM enrollments e JOIN students s ON e.student_id = s.student_id WHERE e.course_id = ?", (course[0],))
-                enrolled_students = cursor.fetchall()
-                for student in enrolled_students:
-                    search_results.append(f" - Student: {student[0]}, ID: {student[1]}")
-        else:
+        if criteria not in school_db.SEARCH_CRITERIA and criteria != ROSTER_CRITERIA:
             self.show_message("Error", "Please select a valid search criterion!")
             return
 
-        self.search_listbox.clear()
-        if search_results:
-            self.search_listbox.addItems(search_results)
+        self.search_results.clear()
+        self.search_args = (criteria, self.search_entry.text())
+        self.search_offset = 0
+        self.search_records = []
+
+        # Narrowing does not apply to set expressions, so roster queries are not cached
+        records = None if criteria == ROSTER_CRITERIA else self.search_cache.lookup(*self.search_args)
+        if records is not None:
+            if self.search_future:
+                self.search_future.cancel()
+                self.search_future = None
+            self.search_token = None
+            self.load_more_button.hide()
+            for _, lines in records:
+                self.search_results.add_lines(lines)
+            if not records:
+                self.search_results.add_lines(["No matching results found."])
+            return
+
+        self.fetch_search_page()
+
+    def fetch_search_page(self):
+        """ Stream the next page of results for the current search into search_listbox """
+        if self.search_future:
+            self.search_future.cancel()
+        self.load_more_button.hide()
+
+        criteria, query = self.search_args
+        offset = self.search_offset
+        token = self.search_token = object()
+        on_chunk = lambda records: self.bridge.call(self.add_search_results, (token, records))
+        on_success = lambda count: self.finish_search_page(token, offset, count)
+        if criteria == ROSTER_CRITERIA:
+            self.search_future = self.run_read(self.roster.stream_query, query, on_chunk, SEARCH_PAGE_SIZE, offset,
+                                               on_success=on_success)
+        else:
+            self.search_future = self.run_read(school_db.stream_search, criteria, query, on_chunk, SEARCH_PAGE_SIZE,
+                                               offset, on_success=on_success)
+
+    def add_search_results(self, chunk):
+        token, records = chunk
+        if token is self.search_token:
+            self.search_records += records
+            for _, lines in records:
+                self.search_results.add_lines(lines)
+
+    def finish_search_page(self, token, offset, count):
+        if token is not self.search_token:
+            return
+        self.search_future = None
+        self.search_offset = offset + count
+        if count == SEARCH_PAGE_SIZE:
+            self.search_results.more_available = True
+            self.load_more_button.show()
         else:
-            self.search_listbox.addItem("No matching results found.")
+            if offset == 0 and self.search_args[0] != ROSTER_CRITERIA:
+                self.search_cache.store(*self.search_args, self.search_records)
+            if self.search_offset == 0:
+                self.search_results.add_lines(["No matching results found."])
 
     def create_student_form(self):
         student_form_frame = QtWidgets.QWidget()
@@ -169,74 +527,82 @@ class SchoolManagementApp(QtWidgets.QWidget):
         self.id_entry = QLineEdit()
         self.email_entry = QLineEdit()
 
-        self.course_listbox = QListWidget()
+        # Read from SQLite rather than the cache, for the enrollment counts and the orders they allow
+        self.course_order = QComboBox()
+        self.course_order.addItems(school_db.COURSE_ORDERS)
+        self.course_order.currentIndexChanged.connect(self.update_course_listbox)
+        self.course_options = KeysetListModel(self.fetch_course_page, self.course_label, parent=self)
+        self.course_listbox = QListView()
+        self.course_listbox.setModel(self.course_options)
         self.course_listbox.setSelectionMode(QtWidgets.QAbstractItemView.MultiSelection)
 
-        self.update_course_listbox()
-
         student_form_layout.addRow("Student Name:", self.name_entry)
         student_form_layout.addRow("Student Age:", self.age_entry)
         student_form_layout.addRow("Student ID:", self.id_entry)
         student_form_layout.addRow("Email:", self.email_entry)
+        student_form_layout.addRow("Sort Courses by:", self.course_order)
         student_form_layout.addRow("Select Courses:", self.course_listbox)
 
         submit_button = QPushButton("Register Student")
         submit_button.clicked.connect(self.create_student)
         student_form_layout.addRow(submit_button)
 
+        bulk_button = QPushButton("Register Students from File")
+        bulk_button.clicked.connect(self.register_students_file)
+        student_form_layout.addRow(bulk_button)
+
         student_form_frame.setLayout(student_form_layout)
         self.main_layout.addWidget(student_form_frame, 1, 0)
 
     def update_course_listbox(self):
-        self.course_listbox.clear()
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT course_name, course_id FROM courses")
-        courses = cursor.fetchall()
-        for course in courses:
-            course_name, course_id = course
-            self.course_listbox.addItem(f"{course_name} (ID: {course_id})")
+        self.course_options.reset("Courses" if self.tables_ready else None)
+
+    def fetch_course_page(self, category, after_key, limit, on_rows):
+        self.run_read(school_db.list_courses, self.course_order.currentText(), after_key, limit, on_success=on_rows)
+
+    @staticmethod
+    def course_label(row):
+        course_id, course_name, enrolled, capacity = row
+        seats = f"{enrolled} of {capacity}" if capacity is not None else f"{enrolled}"
+        return f"{course_name} (ID: {course_id}) - {seats} enrolled"
 
     def create_student(self):
         name = self.name_entry.text()
         age = self.age_entry.text()
         student_id = self.id_entry.text()
         email = self.email_entry.text()
+        selected_courses = [index.data(KeyRole) for index in self.course_listbox.selectionModel().selectedIndexes()]
 
-        try:
-            age = int(age)
-        except ValueError:
-            self.show_message("Error", "Age must be a valid number!")
-            return
-
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM students WHERE student_id = ?", (student_id,))
-        if cursor.fetchone():
-            self.show_message("Error", "A student with this ID already exists!")
-            return
+        def clear_form():
+            self.name_entry.clear()
+            self.age_entry.clear()
+            self.id_entry.clear()
+            self.email_entry.clear()
+            self.course_listbox.clearSelection()
 
-        selected_courses = [self.course_listbox.item(i).text().split(' (ID:')[1][:-1] for i in range(self.course_listbox.count()) if self.course_listbox.item(i).isSelected()]
+        # school_db validates the fields, so the form and the HTTP service report the same errors
+        self.submit_form("student", (student_id, name, age, email, selected_courses),
+                         f"Student {name} has been registered!", clear_form, "Failed to add student to the database")
 
-        if name and student_id and email and selected_courses:
-            try:
-                cursor.execute("INSERT INTO students (student_id, name, age, email) VALUES (?, ?, ?, ?)", 
-                            (student_id, name, age, email))
-                self.conn.commit()
-
-                for course_id in selected_courses:
-                    cursor.execute("INSERT INTO enrollments (student_id, course_id) VALUES (?, ?)", (student_id, course_id))
-                self.conn.commit()
-
-                self.show_message("Success", f"Student {name} has been registered!")
-                self.name_entry.clear()
-                self.age_entry.clear()
-                self.id_entry.clear()
-                self.email_entry.clear()
-                self.course_listbox.clearSelection()
-
-            except sqlite3.Error as e:
-                self.show_message("Error", f"Failed to add student to the database: {e}")
-        else:
-            self.show_message("Error", "All fields are required!")
+    def register_students_file(self):
+        filename, _ = QFileDialog.getOpenFileName(self, "Register Students", "", data_transfer.STUDENT_LIST_FILTER)
+        if filename:
+            started = time.perf_counter()
+
+            def registered(result):
+                count, errors = result
+                elapsed = time.perf_counter() - started
+                message = f"Registered {count} students in {elapsed:.1f} s ({count / max(elapsed, 0.001):.0f} per second)."
+                if errors:
+                    message += f"\n{len(errors)} rows were rejected:\n"
+                    message += "\n".join(f"Row {number}: {error}" for number, error in errors[:REPORTED_ERRORS])
+                    if len(errors) > REPORTED_ERRORS:
+                        message += f"\n... and {len(errors) - REPORTED_ERRORS} more"
+                self.show_message("Success", message)
+
+            self.start_long_task(self.run_write(data_transfer.register_students_file, filename, on_success=registered,
+                                                error_prefix="Failed to register students",
+                                                progress=self.bridge.report_progress))
 
     def create_course_form(self):
         course_form_frame = QtWidgets.QWidget()
@@ -245,12 +611,13 @@ class SchoolManagementApp(QtWidgets.QWidget):
         self.course_entry = QLineEdit()
         self.course_id_entry = QLineEdit()
         self.course_instructor_combobox = QComboBox()
-
-        self.update_instructor_combobox()
+        self.course_capacity_entry = QLineEdit()
+        self.course_capacity_entry.setPlaceholderText("No limit")
 
         course_form_layout.addRow("Course Name:", self.course_entry)
         course_form_layout.addRow("Course ID:", self.course_id_entry)
         course_form_layout.addRow("Select Instructor:", self.course_instructor_combobox)
+        course_form_layout.addRow("Capacity:", self.course_capacity_entry)
 
         submit_button = QPushButton("Add Course")
         submit_button.clicked.connect(self.create_course)
@@ -259,45 +626,20 @@ class SchoolManagementApp(QtWidgets.QWidget):
         course_form_frame.setLayout(course_form_layout)
         self.main_layout.addWidget(course_form_frame, 2, 0)
 
-    def update_instructor_combobox(self):
-        self.course_instructor_combobox.clear()
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT name, instructor_id FROM instructors")
-        instructors = cursor.fetchall()
-        for instructor in instructors:
-            instructor_name, instructor_id = instructor
-            self.course_instructor_combobox.addItem(f"{instructor_name} (ID: {instructor_id})")
-
     def create_course(self):
         course_name = self.course_entry.text()
         course_id = self.course_id_entry.text()
-        selected_instructor_name = self.course_instructor_combobox.currentText()
+        selected_instructor_id = self.course_instructor_combobox.currentData()
+        capacity = self.course_capacity_entry.text().strip()
 
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM instructors WHERE name = ?", (selected_instructor_name,))
-        instructor = cursor.fetchone()
+        def clear_form():
+            self.course_entry.clear()
+            self.course_id_entry.clear()
+            self.course_capacity_entry.clear()
+            self.course_instructor_combobox.setCurrentIndex(0)
 
-        cursor.execute("SELECT * FROM courses WHERE course_id = ?", (course_id,))
-        if cursor.fetchone():
-            self.show_message("Error", "A course with this ID already exists!")
-            return
-
-        if course_name and course_id and instructor:
-            try:
-                cursor.execute("INSERT INTO courses (course_id, course_name, instructor_id) VALUES (?, ?, ?)", 
-                            (course_id, course_name, instructor[0]))
-                self.conn.commit()
-
-                self.show_message("Success", f"Course {course_name} has been added!")
-                self.course_entry.clear()
-                self.course_id_entry.clear()
-                self.course_instructor_combobox.setCurrentIndex(0)
-
-                self.update_course_listbox()
-            except sqlite3.Error as e:
-                self.show_message("Error", f"Failed to add course to the database: {e}")
-        else:
-            self.show_message("Error", "All fields are required!")
+        self.submit_form("course", (course_id, course_name, selected_instructor_id, capacity),
+                         f"Course {course_name} has been added!", clear_form, "Failed to add course to the database")
 
     def create_instructor_form(self):
         instructor_form_frame = QtWidgets.QWidget()
@@ -326,35 +668,14 @@ class SchoolManagementApp(QtWidgets.QWidget):
         instructor_id = self.instructor_id_entry.text()
         email = self.instructor_email_entry.text()
 
-        try:
-            age = int(age)
-        except ValueError:
-            self.show_message("Error", "Age must be a valid number!")
-            return
+        def clear_form():
+            self.instructor_name_entry.clear()
+            self.instructor_age_entry.clear()
+            self.instructor_id_entry.clear()
+            self.instructor_email_entry.clear()
 
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM instructors WHERE instructor_id = ?", (instructor_id,))
-        if cursor.fetchone():
-            self.show_message("Error", "An instructor with this ID already exists!")
-            return
-
-        if name and instructor_id and email:
-            try:
-                cursor.execute("INSERT INTO instructors (instructor_id, name, age, email) VALUES (?, ?, ?, ?)", 
-                            (instructor_id, name, age, email))
-                self.conn.commit()
-
-                self.show_message("Success", f"Instructor {name} has been added!")
-                self.instructor_name_entry.clear()
-                self.instructor_age_entry.clear()
-                self.instructor_id_entry.clear()
-                self.instructor_email_entry.clear()
-
-                self.update_instructor_combobox()
-            except sqlite3.Error as e:
-                self.show_message("Error", f"Failed to add instructor to the database: {e}")
-        else:
-            self.show_message("Error", "All fields are required!")
+        self.submit_form("instructor", (instructor_id, name, age, email),
+                         f"Instructor {name} has been added!", clear_form, "Failed to add instructor to the database")
 
     def create_delete_form(self):
         delete_frame = QtWidgets.QWidget()
@@ -363,9 +684,12 @@ class SchoolManagementApp(QtWidgets.QWidget):
         self.category_combobox = QComboBox()
         self.category_combobox.addItems(["Select Category", "Students", "Instructors", "Courses"])
 
-        self.record_listbox = QListWidget()
+        self.records = KeysetListModel(self.fetch_cached_page, self.record_label, parent=self)
+        self.record_listbox = QListView()
+        self.record_listbox.setModel(self.records)
+        self.record_listbox.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
 
-        delete_button = QPushButton("Delete Selected Record")
+        delete_button = QPushButton("Delete Selected Records")
         delete_button.clicked.connect(self.delete_record)
 
         delete_layout.addWidget(QLabel("Select Category to Delete:"))
@@ -378,63 +702,31 @@ class SchoolManagementApp(QtWidgets.QWidget):
         self.main_layout.addWidget(delete_frame, 4, 0)
 
     def update_record_listbox(self):
-        selected_category = self.category_combobox.currentText()
-        self.record_listbox.clear()
-        cursor = self.conn.cursor()
-
-        if selected_category == "Students":
-            cursor.execute("SELECT * FROM students")
-            students = cursor.fetchall()
-            for student in students:
-                self.record_listbox.addItem(f"{student[1]} (ID: {student[0]})")
-
-        elif selected_category == "Instructors":
-            cursor.execute("SELECT * FROM instructors")
-            instructors = cursor.fetchall()
-            for instructor in instructors:
-                self.record_listbox.addItem(f"{instructor[1]} (ID: {instructor[0]})")
-
-        elif selected_category == "Courses":
-            cursor.execute("SELECT * FROM courses")
-            courses = cursor.fetchall()
-            for course in courses:
-                self.record_listbox.addItem(f"{course[1]} (ID: {course[0]}) - Instructor: {course[2]}")
+        category = self.category_combobox.currentText()
+        self.records.reset(category if self.tables_ready and category in school_db.PAGE_QUERIES else None)
+
+    @staticmethod
+    def record_label(row):
+        if len(row) == 3:
+            return f"{row[1]} (ID: {row[0]}) - Instructor: {row[2]}"
+        return f"{row[1]} (ID: {row[0]})"
 
     def delete_record(self):
         selected_category = self.category_combobox.currentText()
-        selected_item = self.record_listbox.currentItem()
+        record_ids = [index.data(KeyRole) for index in self.record_listbox.selectionModel().selectedIndexes()]
 
-        if selected_item:
-            selected_text = selected_item.text()
-            cursor = self.conn.cursor()
+        if record_ids and selected_category in school_db.PAGE_QUERIES:
+            if len(record_ids) == 1:
+                message = f"{selected_category[:-1]} (ID: {record_ids[0]}) has been deleted."
+            else:
+                message = f"{len(record_ids)} {selected_category.lower()} have been deleted."
 
-            if selected_category == "Students":
-                student_id = selected_text.split('(ID: ')[1][:-1]
-                cursor.execute("DELETE FROM students WHERE student_id = ?", (student_id,))
-                cursor.execute("DELETE FROM enrollments WHERE student_id = ?", (student_id,))
-                self.conn.commit()
+            def deleted(_):
+                self.record_listbox.clearSelection()
+                self.show_message("Success", message)
 
-                self.show_message("Success", f"Student (ID: {student_id}) has been deleted.")
-
-            elif selected_category == "Instructors":
-                instructor_id = selected_text.split('(ID: ')[1][:-1]
-                cursor.execute("DELETE FROM courses WHERE instructor_id = ?", (instructor_id,))
-                cursor.execute("DELETE FROM instructors WHERE instructor_id = ?", (instructor_id,))
-                self.conn.commit()
-
-                self.show_message("Success", f"Instructor (ID: {instructor_id}) has been deleted.")
-
-            elif selected_category == "Courses":
-                course_id = selected_text.split('(ID: ')[1].split(')')[0]
-                cursor.execute("DELETE FROM courses WHERE course_id = ?", (course_id,))
-                cursor.execute("DELETE FROM enrollments WHERE course_id = ?", (course_id,))
-                self.conn.commit()
-
-                self.show_message("Success", f"Course (ID: {course_id}) has been deleted.")
-
-            self.update_record_listbox()
-            self.update_course_listbox()
-            self.update_instructor_combobox()
+            self.run_write(school_db.delete_records, selected_category, record_ids,
+                           on_success=deleted, error_prefix="Failed to delete records")
         else:
             self.show_message("Error", "Please select a record to delete!")
 
@@ -452,34 +744,28 @@ class SchoolManagementApp(QtWidgets.QWidget):
     def clear_all_records(self):
         if QMessageBox.question(self, "Confirm", "Are you sure you want to delete all records? This action cannot be undone!",
                                 QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
-            cursor = self.conn.cursor()
-            
-            try:
-                cursor.execute("DELETE FROM enrollments")
-                cursor.execute("DELETE FROM courses")
-                cursor.execute("DELETE FROM students")
-                cursor.execute("DELETE FROM instructors")
-                self.conn.commit()
-
-                self.update_course_listbox()
-                self.update_instructor_combobox()
-                self.update_record_listbox()
-
+            def cleared(_):
                 self.update_search_criteria()
                 self.update_category_combobox()
 
                 self.show_message("Success", "All records have been cleared!")
-            except sqlite3.Error as e:
-                self.show_message("Error", f"Failed to clear records: {e}")
+
+            self.run_write(school_db.clear_all, on_success=cleared, error_prefix="Failed to clear records")
 
     def update_search_criteria(self):
+        self.search_timer.stop()
+        if self.search_future:
+            self.search_future.cancel()
+            self.search_future = None
+        self.search_token = None
+        self.load_more_button.hide()
         self.search_entry.clear()
-        self.search_listbox.clear()
+        self.search_results.clear()
         self.search_criteria.setCurrentIndex(0)
 
     def update_category_combobox(self):
         self.category_combobox.setCurrentIndex(0)
-        self.record_listbox.clear()
+        self.records.reset()
 
     def create_save_load_buttons(self):
         save_load_frame = QtWidgets.QWidget()
@@ -493,97 +779,132 @@ class SchoolManagementApp(QtWidgets.QWidget):
         load_button.clicked.connect(self.load_data)
         save_load_layout.addWidget(load_button)
 
-        save_load_frame.setLayout(save_load_layout)
-        self.main_layout.addWidget(save_load_frame, 6, 0, 1, 2)
+        backup_button = QPushButton("Back Up")
+        backup_button.clicked.connect(self.backup_data)
+        save_load_layout.addWidget(backup_button)
 
-    def save_data(self):
-        filename, _ = QFileDialog.getSaveFileName(self, "Save File", "", "JSON Files (*.json);;All Files (*)")
-        if filename:
-            data = {
-                "students": [],
-                "instructors": [],
-                "courses": []
-            }
-            cursor = self.conn.cursor()
-
-            cursor.execute("SELECT * FROM students")
-            students = cursor.fetchall()
-            for student in students:
-                data["students"].append({
-                    "student_id": student[0],
-                    "name": student[1],
-                    "age": student[2],
-                    "email": student[3]
-                })
-
-            cursor.execute("SELECT * FROM instructors")
-            instructors = cursor.fetchall()
-            for instructor in instructors:
-                data["instructors"].append({
-                    "instructor_id": instructor[0],
-                    "name": instructor[1],
-                    "age": instructor[2],
-                    "email": instructor[3]
-                })
-
-            cursor.execute("SELECT * FROM courses")
-            courses = cursor.fetchall()
-            for course in courses:
-                data["courses"].append({
-                    "course_id": course[0],
-                    "course_name": course[1],
-                    "instructor_id": course[2]
-                })
-
-            with open(filename, 'w') as file:
-                json.dump(data, file)
-
-            self.show_message("Success", "Data has been saved!")
+        # Write-behind: forms are checked and queued at once, and written in groups every FLUSH_MS
+        self.write_behind = QCheckBox("Queue Form Writes")
+        save_load_layout.addWidget(self.write_behind)
+        self.pending_label = QLabel()
+        self.update_pending_writes()
+        save_load_layout.addWidget(self.pending_label)
 
-    def load_data(self):
-        filename, _ = QFileDialog.getOpenFileName(self, "Load File", "", "JSON Files (*.json);;All Files (*)")
-        if filename:
-            with open(filename, 'r') as file:
-                data = json.load(file)
+        diagnostics_button = QPushButton("Diagnostics")
+        diagnostics_button.clicked.connect(self.show_diagnostics)
+        save_load_layout.addWidget(diagnostics_button)
 
-            cursor = self.conn.cursor()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.hide()
+        self.bridge.progressed.connect(self.update_progress)
+        save_load_layout.addWidget(self.progress_bar)
 
-            try:
-                cursor.execute("DELETE FROM enrollments")
-                cursor.execute("DELETE FROM courses")
-                cursor.execute("DELETE FROM students")
-                cursor.execute("DELETE FROM instructors")
-                self.conn.commit()
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.hide()
+        self.cancel_button.clicked.connect(self.cancel_long_task)
+        save_load_layout.addWidget(self.cancel_button)
 
-                for student in data["students"]:
-                    cursor.execute("INSERT INTO students (student_id, name, age, email) VALUES (?, ?, ?, ?)",
-                                (student["student_id"], student["name"], student["age"], student["email"]))
+        save_load_frame.setLayout(save_load_layout)
+        self.main_layout.addWidget(save_load_frame, 6, 0, 1, 2)
 
-                for instructor in data["instructors"]:
-                    cursor.execute("INSERT INTO instructors (instructor_id, name, age, email) VALUES (?, ?, ?, ?)",
-                                (instructor["instructor_id"], instructor["name"], instructor["age"], instructor["email"]))
+    def show_diagnostics(self):
+        if self.diagnostics is None:
+            self.diagnostics = DiagnosticsPanel(self.metrics)
+        self.diagnostics.show()
+        self.diagnostics.raise_()
+
+    def start_long_task(self, future):
+        """ Show the progress bar and cancel button until the future is done """
+        self.long_task = future
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.cancel_button.show()
+        self.bridge.watch(future, self.finish_long_task)
+
+    def finish_long_task(self, future):
+        if future is self.long_task:
+            self.long_task = None
+            self.progress_bar.hide()
+            self.cancel_button.hide()
+
+    def update_progress(self, done, total):
+        self.progress_bar.setMaximum(max(total, 1))
+        self.progress_bar.setValue(done)
+
+    def cancel_long_task(self):
+        if self.long_task:
+            self.long_task.cancel()
 
-                for course in data["courses"]:
-                    cursor.execute("INSERT INTO courses (course_id, course_name, instructor_id) VALUES (?, ?, ?)",
-                                (course["course_id"], course["course_name"], course["instructor_id"]))
+    def save_data(self):
+        filename, selected_filter = QFileDialog.getSaveFileName(self, "Save File", "", data_transfer.file_filter())
+        if filename:
+            filename = data_transfer.with_extension(filename, selected_filter)
+
+            def saved(_):
+                self.show_message("Success", "Data has been saved!")
+
+            self.start_long_task(self.run_read(data_transfer.export_file, filename, on_success=saved,
+                                               error_prefix="Failed to save data", progress=self.bridge.report_progress))
 
-                self.conn.commit()
+    def backup_data(self):
+        directory = QFileDialog.getExistingDirectory(self, "Backup Folder")
+        if directory:
+            def backed_up(result):
+                kind, filename, records = result
+                if kind is None:
+                    self.show_message("Backup", "Nothing has changed since the last backup.")
+                else:
+                    self.show_message("Success", f"Saved a {kind} backup of {records} records as {filename}.")
 
-                self.update_course_listbox()
-                self.update_instructor_combobox()
+            self.start_long_task(self.run_read(data_transfer.backup, directory, on_success=backed_up,
+                                               error_prefix="Failed to back up data", progress=self.bridge.report_progress))
 
-                self.show_message("Success", "Data has been loaded!")
-            
-            except sqlite3.Error as e:
-                self.show_message("Error", f"Failed to load data: {e}")
+    def load_data(self):
+        filenames, _ = QFileDialog.getOpenFileNames(self, "Load File", "", data_transfer.file_filter(backups=True))
+        if filenames:
+            # A backup manifest restores its whole chain over the current records
+            if len(filenames) == 1 and data_transfer.is_backup_manifest(filenames[0]):
+                mode = "replace"
+            else:
+                choice, ok = QInputDialog.getItem(self, "Load Data", "How should the file be loaded?",
+                                                  list(LOAD_MODES), 0, False)
+                if not ok:
+                    return
+                mode = LOAD_MODES[choice]
+
+            if len(filenames) == 1:
+                def loaded(_):
+                    self.show_message("Success", "Data has been loaded!")
+
+                self.start_long_task(self.run_write(data_transfer.import_file, filenames[0], mode, on_success=loaded,
+                                                    error_prefix="Failed to load data",
+                                                    progress=self.bridge.report_progress))
+                return
+
+            # Several files are shards of one export, parsed in parallel and loaded together
+            def loaded_shards(reports):
+                lines = [f"{os.path.basename(report['file'])}: {report['inserted']} loaded, "
+                         f"{report['duplicates']} duplicates ({report['parse_seconds']} s parsing)"
+                         for report in reports]
+                self.show_message("Success", "Data has been loaded!\n\n" + "\n".join(lines))
+
+            self.start_long_task(self.run_write(data_transfer.import_files, filenames, mode, on_success=loaded_shards,
+                                                error_prefix="Failed to load data",
+                                                progress=self.bridge.report_progress))
 
     def update_instructor_combobox(self):
+        if self.cache.loaded:
+            count = self.cache.count_records("Instructors")
+            self.fill_instructor_combobox(self.cache.list_page("Instructors", None, count))
+        else:
+            # LIMIT -1: every row
+            self.run_read(school_db.list_page, "Instructors", None, -1, on_success=self.fill_instructor_combobox)
+
+    def fill_instructor_combobox(self, instructors):
+        # Items carry the instructor ID, so instructors sharing a name stay distinct
         self.course_instructor_combobox.clear()
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM instructors")
-        instructors = cursor.fetchall()
-        instructor_names = [instructor[0] for instructor in instructors]
-        self.course_instructor_combobox.addItems(instructor_names)
+        for instructor_id, name in instructors:
+            self.course_instructor_combobox.addItem(f"{name} (ID: {instructor_id})", instructor_id)
 
     def show_message(self, title, message):
         msg = QMessageBox()
@@ -592,6 +913,11 @@ class SchoolManagementApp(QtWidgets.QWidget):
         msg.exec_()
 
 if __name__ == "__main__":
+    # --serve runs the HTTP JSON API (school_service.py) instead of the windows
+    if "--serve" in sys.argv[1:]:
+        import school_service
+        school_service.main([arg for arg in sys.argv[1:] if arg != "--serve"])
+        sys.exit()
     app = QtWidgets.QApplication(sys.argv)
     window = SchoolManagementApp()
     window.show()
@@ -0,0 +1,109 @@
+from PyQt5 import QtCore
+from PyQt5.QtCore import Qt, QModelIndex
+
+# Role holding the primary key of a row
+KeyRole = Qt.UserRole
+
+
+class KeysetListModel(QtCore.QAbstractListModel):
+    """ List model over one table that loads rows page by page as the view scrolls
+
+    Pages are requested with fetch_page(category, after_key, limit, on_rows),
+    ordered by primary key and continuing after the last key already loaded.
+    on_rows may be called later (from a database request) or right away
+    (from an EntityCache). Rows are (key, label) with the key available
+    under KeyRole.
+    """
+
+    def __init__(self, fetch_page, label, page_size=200, parent=None):
+        super().__init__(parent)
+        self.fetch_page = fetch_page
+        self.label = label
+        self.page_size = page_size
+        self.category = None
+        self.rows = []
+        self.exhausted = True
+        self.fetching = None
+
+    def reset(self, category=None):
+        """ Show the rows of another category (or nothing) starting from the first page """
+        self.beginResetModel()
+        self.category = category
+        self.rows = []
+        self.exhausted = category is None
+        self.fetching = None
+        self.endResetModel()
+
+    def refresh(self):
+        self.reset(self.category)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        key, label = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return label
+        if role == KeyRole:
+            return key
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and self.fetching is None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        after_key = self.rows[-1][0] if self.rows else None
+        token = self.fetching = object()
+        self.fetch_page(self.category, after_key, self.page_size, lambda rows: self.add_page(token, rows))
+
+    def add_page(self, token, rows):
+        if token is not self.fetching:
+            return
+        self.fetching = None
+        self.exhausted = len(rows) < self.page_size
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows += [(row[0], self.label(row)) for row in rows]
+            self.endInsertRows()
+
+
+class SearchResultModel(QtCore.QAbstractListModel):
+    """ Lines of the search results; asks for the next page when the view reaches the end """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.lines = []
+        self.more_available = False
+        self.request_more = None
+
+    def clear(self):
+        self.beginResetModel()
+        self.lines = []
+        self.more_available = False
+        self.endResetModel()
+
+    def add_lines(self, lines):
+        if lines:
+            self.beginInsertRows(QModelIndex(), len(self.lines), len(self.lines) + len(lines) - 1)
+            self.lines += lines
+            self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.lines)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid() and role == Qt.DisplayRole:
+            return self.lines[index.row()]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.more_available
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self.more_available = False
+            self.request_more()
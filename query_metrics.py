@@ -0,0 +1,204 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# Upper bounds of the latency histogram buckets, in milliseconds; the last bucket is open-ended
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Histograms cover the last SLICES slices of SLICE_SECONDS each
+SLICE_SECONDS = 60
+SLICES = 5
+# Statements at least this slow are written to the slow-query log with their plan
+SLOW_QUERY_MS = 100
+# The slow-query log sits next to the database, like write_buffer's queue file
+SLOW_QUERY_SUFFIX = "-slow_queries.log"
+# Slow queries kept in memory for the diagnostics panel and dumps
+RECENT_SLOW_QUERIES = 50
+
+PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+SPACES = re.compile(r"\s+")
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+def statement_key(sql):
+    """ One key per statement shape: whitespace collapsed and IN lists of any length folded together """
+    return PLACEHOLDER_LIST.sub("(?, ...)", SPACES.sub(" ", sql).strip())
+
+
+class RollingHistogram:
+    """ Latency histogram over the last few minutes, kept as per-minute bucket counts """
+
+    def __init__(self):
+        self.slices = deque()
+        self.count = 0
+        self.total_ms = 0.0
+
+    def add(self, ms, now=None):
+        number = int((time.time() if now is None else now) // SLICE_SECONDS)
+        if not self.slices or self.slices[-1][0] != number:
+            self.slices.append((number, [0] * (len(BUCKETS_MS) + 1), [0.0]))
+        while self.slices[0][0] <= number - SLICES:
+            self.slices.popleft()
+        _, counts, largest = self.slices[-1]
+        counts[bisect_left(BUCKETS_MS, ms)] += 1
+        largest[0] = max(largest[0], ms)
+        self.count += 1
+        self.total_ms += ms
+
+    def snapshot(self, now=None):
+        """ Recent count, bucket counts, max and estimated percentiles, plus all-time count and total """
+        oldest = int((time.time() if now is None else now) // SLICE_SECONDS) - SLICES
+        counts = [0] * (len(BUCKETS_MS) + 1)
+        largest = 0.0
+        for number, slice_counts, slice_largest in self.slices:
+            if number > oldest:
+                counts = [a + b for a, b in zip(counts, slice_counts)]
+                largest = max(largest, slice_largest[0])
+        recent = sum(counts)
+
+        def percentile(fraction):
+            # Upper bound of the bucket holding the percentile, capped by the largest value seen
+            seen = 0
+            for bound, count in zip(BUCKETS_MS + (largest,), counts):
+                seen += count
+                if seen >= fraction * recent:
+                    return round(min(bound, largest), 3)
+            return round(largest, 3)
+
+        return {
+            "recent_count": recent,
+            "p50_ms": percentile(0.50) if recent else None,
+            "p90_ms": percentile(0.90) if recent else None,
+            "p99_ms": percentile(0.99) if recent else None,
+            "max_ms": round(largest, 3),
+            "buckets": {f"<={bound}" if index < len(BUCKETS_MS) else f">{BUCKETS_MS[-1]}": count
+                        for index, (bound, count) in enumerate(zip(BUCKETS_MS + (None,), counts)) if count},
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+        }
+
+
+class QueryMetrics:
+    """ Latency histograms for SQL statements and UI actions, and the slow-query log
+
+    Statements are timed by TracingConnection; UI actions are recorded by
+    the windows with record_action. Slow queries are appended to slow_log,
+    if one is given. Safe to use from any thread.
+    """
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, slow_log=None):
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self.lock = threading.Lock()
+        self.statements = {}
+        self.actions = {}
+        self.slow_queries = deque(maxlen=RECENT_SLOW_QUERIES)
+        self.plans = {}
+
+    def record_statement(self, conn, sql, parameters, seconds):
+        key = statement_key(sql)
+        ms = seconds * 1000
+        with self.lock:
+            self.statements.setdefault(key, RollingHistogram()).add(ms)
+        if ms >= self.slow_ms:
+            self.log_slow_query(conn, key, sql, parameters, ms)
+
+    def record_action(self, name, seconds):
+        with self.lock:
+            self.actions.setdefault(name, RollingHistogram()).add(seconds * 1000)
+
+    def log_slow_query(self, conn, key, sql, parameters, ms):
+        if key not in self.plans:
+            self.plans[key] = query_plan(conn, sql, parameters)
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "ms": round(ms, 3),
+            "thread": threading.current_thread().name,
+            "sql": conn.last_statement or sql,
+            "plan": self.plans[key],
+        }
+        with self.lock:
+            self.slow_queries.append(entry)
+            if self.slow_log:
+                with open(self.slow_log, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(entry) + "\n")
+
+    def snapshot(self):
+        """ Everything recorded so far as plain data, slowest statements (by total time) first """
+        with self.lock:
+            statements = {key: histogram.snapshot() for key, histogram in self.statements.items()}
+            actions = {name: histogram.snapshot() for name, histogram in self.actions.items()}
+            slow_queries = list(self.slow_queries)
+        return {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "actions": dict(sorted(actions.items())),
+            "statements": dict(sorted(statements.items(), key=lambda item: -item[1]["total_ms"])),
+            "slow_queries": slow_queries,
+        }
+
+    def dump(self, filename):
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+
+def query_plan(conn, sql, parameters):
+    """ EXPLAIN QUERY PLAN rows for sql as (id, parent, detail), or [] for statements that have no plan """
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return []
+    try:
+        # A plain cursor, so explaining is not itself timed and traced
+        cursor = conn.cursor(sqlite3.Cursor)
+        return [(row[0], row[1], row[3]) for row in cursor.execute("EXPLAIN QUERY PLAN " + sql, parameters or ())]
+    except sqlite3.Error as e:
+        return [(0, 0, f"plan unavailable: {e}")]
+
+
+class TracingCursor(sqlite3.Cursor):
+    """ Cursor that reports how long each execute took (up to the first row) to its connection's metrics """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.metrics.record_statement(self.connection, sql, parameters,
+                                                     time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # Explain with the first row, the plan is the same for all of them
+            first = seq_of_parameters[0] if seq_of_parameters else ()
+            self.connection.metrics.record_statement(self.connection, sql, first, time.perf_counter() - started)
+
+
+class TracingConnection(sqlite3.Connection):
+    """ Connection whose statements are timed into metrics; the trace callback keeps the last one with its values bound """
+
+    metrics = None
+    last_statement = None
+
+    def trace(self, metrics):
+        self.metrics = metrics
+        self.set_trace_callback(self.remember_statement)
+
+    def remember_statement(self, sql):
+        # Statements run by triggers are traced as "-- TRIGGER ..." comments; keep the statement that fired them
+        if not sql.startswith("--"):
+            self.last_statement = sql
+
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,238 @@
+import re
+import threading
+
+import school_db
+from data_transfer import journal_changes
+
+# The search criterion answered by RosterIndex instead of iter_search
+ROSTER_CRITERIA = "Roster query"
+# More changed keys than this since the last sync and the index is rebuilt instead of patched
+RELOAD_CHANGES = 20000
+# Keys checked per query while patching the index
+CHUNK_SIZE = 500
+
+TOKENS = re.compile(r"\(|\)|[^\s()]+")
+OPERATORS = {"and": "and", "&": "and", "or": "or", "|": "or", "minus": "minus", "-": "minus"}
+
+
+def bit_positions(bits):
+    """ Yield the positions of the set bits of a non-negative int, lowest first """
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield index * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+class RosterIndex:
+    """ Enrollments held in memory as one bitset per course, for set queries over rosters
+
+    Every student gets a dense number, and each course an int whose bit n
+    is set when student n is enrolled, so intersections, unions,
+    differences and co-enrollment counts are single int operations. The
+    index follows the database through backup_journal: sync() patches it
+    with the rows changed since the last sync and rebuilds it only when the
+    journal cannot say what changed. Safe to use from any thread.
+
+    Queries combine course IDs, "instructor:ID" (any of the instructor's
+    courses) and "all" with and/&, or/|, minus/-, not and parentheses;
+    "overlap" followed by courses or instructors lists the students shared
+    by every pair of them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = None
+        self.student_numbers = {}
+        self.student_ids = []
+        self.students = 0
+        self.courses = {}
+        self.instructors = {}
+
+    def sync(self, conn):
+        """ Bring the index up to date with conn's snapshot of the database """
+        if not conn.in_transaction:
+            # One snapshot for the journal and the rows it points to
+            conn.execute("BEGIN")
+        through = school_db.last_journal_seq(conn)
+        with self.lock:
+            if through == self.seq:
+                return
+            # A journal behind the index means writes it had seen were rolled back
+            changes = None if self.seq is None or through < self.seq else journal_changes(conn, self.seq, through)
+            if changes is None or sum(map(len, changes.values())) > RELOAD_CHANGES:
+                self.load(conn)
+            else:
+                self.patch(conn, changes)
+            self.seq = through
+
+    def load(self, conn):
+        self.student_ids = [row[0] for row in conn.execute("SELECT student_id FROM students ORDER BY student_id")]
+        self.student_numbers = {student_id: number for number, student_id in enumerate(self.student_ids)}
+        self.students = (1 << len(self.student_ids)) - 1
+        self.instructors = {}
+        members = {}
+        for course_id, instructor_id in conn.execute("SELECT course_id, instructor_id FROM courses"):
+            self.instructors[course_id] = instructor_id
+            members[course_id] = bytearray((len(self.student_ids) + 7) // 8)
+        for student_id, course_id in conn.execute("SELECT student_id, course_id FROM enrollments"):
+            number = self.student_numbers.get(student_id)
+            if number is not None and course_id in members:
+                members[course_id][number >> 3] |= 1 << (number & 7)
+        self.courses = {course_id: int.from_bytes(data, "little") for course_id, data in members.items()}
+
+    def patch(self, conn, changes):
+        present = school_db.existing_keys(conn, "students", "student_id", [key[0] for key in changes["students"]],
+                                          CHUNK_SIZE)
+        removed = 0
+        for (student_id,) in changes["students"]:
+            number = self.student_numbers.get(student_id)
+            if student_id in present and number is None:
+                self.student_numbers[student_id] = len(self.student_ids)
+                self.students |= 1 << len(self.student_ids)
+                self.student_ids.append(student_id)
+            elif student_id not in present and number is not None:
+                # The number is not reused
+                del self.student_numbers[student_id]
+                self.student_ids[number] = None
+                removed |= 1 << number
+        if removed:
+            # The enrollment loop below skips students without a number, so clear their bits here
+            self.students &= ~removed
+            for course_id in self.courses:
+                self.courses[course_id] &= ~removed
+
+        courses = [key[0] for key in changes["courses"]]
+        current = {}
+        for start in range(0, len(courses), CHUNK_SIZE):
+            chunk = courses[start:start + CHUNK_SIZE]
+            current.update(conn.execute(f"SELECT course_id, instructor_id FROM courses "
+                                        f"WHERE course_id IN ({', '.join('?' * len(chunk))})", chunk))
+        for course_id in courses:
+            if course_id in current:
+                self.instructors[course_id] = current[course_id]
+                self.courses.setdefault(course_id, 0)
+            else:
+                self.instructors.pop(course_id, None)
+                self.courses.pop(course_id, None)
+
+        enrollments = list(changes["enrollments"])
+        enrolled = set()
+        for start in range(0, len(enrollments), CHUNK_SIZE):
+            chunk = enrollments[start:start + CHUNK_SIZE]
+            enrolled.update(conn.execute(
+                f"SELECT student_id, course_id FROM enrollments WHERE (student_id, course_id) IN "
+                f"(VALUES {', '.join(['(?, ?)'] * len(chunk))})", [value for key in chunk for value in key]))
+        for student_id, course_id in enrollments:
+            number = self.student_numbers.get(student_id)
+            if number is None or course_id not in self.courses:
+                continue
+            if (student_id, course_id) in enrolled:
+                self.courses[course_id] |= 1 << number
+            else:
+                self.courses[course_id] &= ~(1 << number)
+
+    def evaluate(self, query):
+        """ Return the bitset of the students matching a set expression; raise ValueError if it is invalid """
+        tokens = TOKENS.findall(query)
+        if not tokens:
+            raise ValueError("Enter courses to combine, for example: C1 and (C2 or instructor:I1) minus C3")
+        position = 0
+
+        def peek():
+            return tokens[position].lower() if position < len(tokens) else None
+
+        def take():
+            nonlocal position
+            position += 1
+            return tokens[position - 1]
+
+        def union():
+            bits = intersection()
+            while OPERATORS.get(peek()) == "or":
+                take()
+                bits |= intersection()
+            return bits
+
+        def intersection():
+            bits = operand()
+            while OPERATORS.get(peek()) in ("and", "minus"):
+                if OPERATORS[take().lower()] == "and":
+                    bits &= operand()
+                else:
+                    bits &= ~operand()
+            return bits & self.students
+
+        def operand():
+            token = peek()
+            if token is None or token == ")" or token in OPERATORS:
+                raise ValueError("Incomplete roster query" if token is None else f"Unexpected {tokens[position]}")
+            take()
+            if token == "not":
+                return self.students & ~operand()
+            if token == "(":
+                bits = union()
+                if peek() != ")":
+                    raise ValueError("Missing )")
+                take()
+                return bits
+            if token == "all":
+                return self.students
+            return self.roster(tokens[position - 1])
+
+        bits = union()
+        if position < len(tokens):
+            raise ValueError(f"Unexpected {tokens[position]}")
+        return bits
+
+    def roster(self, name):
+        """ Bitset of one course, or of every course of "instructor:ID" """
+        if name.lower().startswith("instructor:"):
+            instructor_id = name.split(":", 1)[1]
+            course_ids = [course_id for course_id, teacher in self.instructors.items() if teacher == instructor_id]
+            if not course_ids:
+                raise ValueError(f"No courses for instructor: {instructor_id}")
+            bits = 0
+            for course_id in course_ids:
+                bits |= self.courses[course_id]
+            return bits
+        if name not in self.courses:
+            raise ValueError(f"Unknown course: {name}")
+        return self.courses[name]
+
+    def overlap(self, names):
+        """ [(first, second, shared students)] for every pair of names, then (name, name, size) for each name """
+        if len(names) < 2:
+            raise ValueError("Give overlap at least two courses or instructors")
+        rosters = [self.roster(name) for name in names]
+        pairs = [(names[i], names[j], (rosters[i] & rosters[j]).bit_count())
+                 for i in range(len(names)) for j in range(i + 1, len(names))]
+        return pairs + [(name, name, bits.bit_count()) for name, bits in zip(names, rosters)]
+
+    def stream_query(self, conn, query, on_chunk, limit=None, offset=0):
+        """ Run a roster query like school_db.stream_search, passing the (text, lines) records to on_chunk """
+        self.sync(conn)
+        tokens = TOKENS.findall(query)
+        with self.lock:
+            if tokens and tokens[0].lower() == "overlap":
+                rows = self.overlap(tokens[1:])
+                records = [(f"{first} {second}", [f"{first}: {shared} students" if first == second else
+                                                  f"{first} & {second}: {shared} shared students"])
+                           for first, second, shared in rows]
+                records = records[offset:None if limit is None else offset + limit]
+            else:
+                student_ids = sorted(self.student_ids[number] for number in bit_positions(self.evaluate(query)))
+                student_ids = student_ids[offset:None if limit is None else offset + limit]
+                records = None
+        if records is None:
+            names = {}
+            for start in range(0, len(student_ids), CHUNK_SIZE):
+                chunk = student_ids[start:start + CHUNK_SIZE]
+                names.update(conn.execute(f"SELECT student_id, name FROM students "
+                                          f"WHERE student_id IN ({', '.join('?' * len(chunk))})", chunk))
+            records = [(f"{names.get(student_id) or ''} {student_id}",
+                        [f"Student: {names.get(student_id)}, ID: {student_id}"]) for student_id in student_ids]
+        if records:
+            on_chunk(records)
+        return len(records)
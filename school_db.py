@@ -0,0 +1,929 @@
+import random
+import re
+import sqlite3
+import time
+import unicodedata
+
+from query_metrics import TracingConnection
+
+DB_PATH = 'school_management.db'
+
+# Full-text indexes kept in sync with their table by triggers:
+# (index, table, indexed columns)
+SEARCH_INDEXES = [
+    ("students_fts", "students", ("student_id", "name", "email")),
+    ("instructors_fts", "instructors", ("instructor_id", "name", "email")),
+    ("courses_fts", "courses", ("course_id", "course_name")),
+]
+
+SEARCH_CRITERIA = ("Name", "ID", "Email", "Course")
+# Rows fetched per fetchmany call when streaming search results
+SEARCH_CHUNK_SIZE = 500
+
+# Tables whose inserts, updates and deletes are recorded in change_log: (table, key column)
+LOGGED_TABLES = [("students", "student_id"), ("instructors", "instructor_id"), ("courses", "course_id")]
+# Number of change_log entries kept; readers further behind reload everything
+CHANGE_LOG_SIZE = 10000
+# Tables whose changed keys are recorded in backup_journal for incremental backups: (table, key columns)
+JOURNALED_TABLES = [("students", ("student_id",)), ("instructors", ("instructor_id",)), ("courses", ("course_id",)),
+                    ("enrollments", ("student_id", "course_id"))]
+# Number of backup_journal entries kept; a backup further behind is taken in full
+BACKUP_JOURNAL_SIZE = 200000
+
+
+# Connection tuning: seconds to wait for a lock, prepared statements kept per
+# connection, page cache (negative means KiB) and bytes read through mmap
+BUSY_TIMEOUT = 30
+STATEMENT_CACHE_SIZE = 256
+CACHE_SIZE = -16 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+# Write transactions that still find the database locked after BUSY_TIMEOUT are retried this many
+# times, sleeping a random part of an exponentially growing backoff (seconds) in between
+WRITE_RETRIES = 5
+RETRY_BACKOFF = 0.05
+RETRY_BACKOFF_MAX = 2.0
+
+# Current definition of each school table, parents before children; {name} is the table name
+TABLES = {
+    "students": '''
+    CREATE TABLE {name} (
+        student_id TEXT PRIMARY KEY,
+        name TEXT,
+        age INTEGER,
+        email TEXT
+    )
+    ''',
+    "instructors": '''
+    CREATE TABLE {name} (
+        instructor_id TEXT PRIMARY KEY,
+        name TEXT,
+        age INTEGER,
+        email TEXT
+    )
+    ''',
+    "courses": '''
+    CREATE TABLE {name} (
+        course_id TEXT PRIMARY KEY,
+        course_name TEXT,
+        instructor_id TEXT,
+        capacity INTEGER CHECK (capacity >= 0),
+        FOREIGN KEY (instructor_id) REFERENCES instructors(instructor_id) ON DELETE CASCADE
+    )
+    ''',
+    "enrollments": '''
+    CREATE TABLE {name} (
+        student_id TEXT,
+        course_id TEXT,
+        FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
+        FOREIGN KEY (course_id) REFERENCES courses(course_id) ON DELETE CASCADE,
+        PRIMARY KEY (student_id, course_id)
+    )
+    ''',
+}
+
+# Secondary indexes: (index, table, indexed expression)
+SCHEMA_INDEXES = [
+    ("enrollments_course_id", "enrollments", "course_id"),
+    ("courses_instructor_id", "courses", "instructor_id"),
+    ("students_name_lower", "students", "lower(name)"),
+    ("instructors_name_lower", "instructors", "lower(name)"),
+]
+
+
+def connect(path=DB_PATH, read_only=False, check_same_thread=True, metrics=None):
+    """ Open a tuned connection with foreign keys enabled
+
+    Writable connections switch the database to WAL, so readers and the
+    writer no longer block each other. read_only connections refuse writes.
+    With a QueryMetrics, every statement on the connection is timed into it.
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE,
+                           check_same_thread=check_same_thread,
+                           factory=sqlite3.Connection if metrics is None else TracingConnection)
+    if metrics is not None:
+        conn.trace(metrics)
+    conn.execute("PRAGMA foreign_keys = ON")
+    if not read_only:
+        conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = {CACHE_SIZE}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def create_tables(conn):
+    """ Create the school tables, or upgrade the ones an older version created """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students'").fetchone()
+    if exists:
+        migrate(conn)
+    else:
+        for name, sql in TABLES.items():
+            conn.execute(sql.format(name=name))
+        create_schema_indexes(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    create_search_indexes(conn)
+    create_change_log(conn)
+    create_stats(conn)
+    create_capacity_trigger(conn)
+    create_backup_journal(conn)
+
+
+def create_schema_indexes(conn):
+    for index, table, expression in SCHEMA_INDEXES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({expression})")
+
+
+def add_delete_cascades(conn):
+    """ Migration 1: rebuild courses and enrollments with ON DELETE CASCADE
+
+    Rows whose parent is already gone (databases from before foreign keys
+    were enforced can have them) cannot satisfy the new constraints:
+    orphaned enrollments are dropped and orphaned courses lose their
+    instructor. Course rowids are kept so the search index stays valid.
+    """
+    conn.execute("DELETE FROM enrollments WHERE student_id NOT IN (SELECT student_id FROM students) "
+                 "OR course_id NOT IN (SELECT course_id FROM courses)")
+    conn.execute("UPDATE courses SET instructor_id = NULL "
+                 "WHERE instructor_id NOT IN (SELECT instructor_id FROM instructors)")
+    for table in ("enrollments", "courses"):
+        columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA table_info({table})"))
+        conn.execute(TABLES[table].format(name=f"{table}_new"))
+        conn.execute(f"INSERT INTO {table}_new (rowid, {columns}) SELECT rowid, {columns} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+def add_course_capacity(conn):
+    """ Migration 3: courses.capacity, the most students a course takes (NULL for no limit) """
+    # Migration 1 rebuilds courses from TABLES, which already has the column
+    if "capacity" not in {row[1] for row in conn.execute("PRAGMA table_info(courses)")}:
+        conn.execute("ALTER TABLE courses ADD COLUMN capacity INTEGER CHECK (capacity >= 0)")
+
+
+def replace_capacity_trigger(conn):
+    """ Migration 4: drop the first enrollments_capacity, which also refused rows ON CONFLICT would skip """
+    # create_tables creates the current one after the migrations
+    conn.execute("DROP TRIGGER IF EXISTS enrollments_capacity")
+
+
+# Schema upgrades in order; PRAGMA user_version counts how many a database has had
+MIGRATIONS = [add_delete_cascades, create_schema_indexes, add_course_capacity, replace_capacity_trigger]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn):
+    """ Apply the migrations a database has not had yet, each in its own transaction
+
+    Foreign keys are switched off while a migration rebuilds tables and
+    checked as a whole before it commits. Commits any open transaction.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(f"Database schema version {version} is newer than this program supports")
+    for number in range(version, SCHEMA_VERSION):
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            conn.execute("BEGIN")
+            MIGRATIONS[number](conn)
+            if conn.execute("PRAGMA foreign_key_check").fetchone():
+                raise sqlite3.IntegrityError(f"Migration {number + 1} left rows without their parent")
+            conn.execute(f"PRAGMA user_version = {number + 1}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+
+
+def create_capacity_trigger(conn):
+    """ Refuse enrollments past a course's capacity, checked by the INSERT itself so no writer can race it
+
+    Rows already enrolled are let through, so ON CONFLICT DO NOTHING can
+    skip them in a full course. Reads the count from course_stats, which
+    create_stats keeps current.
+    """
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS enrollments_capacity BEFORE INSERT ON enrollments
+    WHEN (SELECT capacity FROM courses WHERE course_id = NEW.course_id) IS NOT NULL
+         AND NOT EXISTS (SELECT 1 FROM enrollments WHERE student_id = NEW.student_id AND course_id = NEW.course_id)
+    BEGIN
+        SELECT RAISE(ABORT, 'Course is full')
+        WHERE (SELECT enrolled FROM course_stats WHERE course_id = NEW.course_id)
+              >= (SELECT capacity FROM courses WHERE course_id = NEW.course_id);
+    END
+    ''')
+
+
+def create_change_log(conn):
+    """ Create change_log and the triggers that append a row to it for every write """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT,
+        entity_id TEXT,
+        op TEXT
+    )
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS change_log_trim AFTER INSERT ON change_log BEGIN
+        DELETE FROM change_log WHERE seq <= new.seq - {CHANGE_LOG_SIZE};
+    END
+    ''')
+    for table, key in LOGGED_TABLES:
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_log_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO change_log (entity, entity_id, op) VALUES ('{table}', new.{key}, 'insert');
+        END
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_log_au AFTER UPDATE ON {table} BEGIN
+            INSERT INTO change_log (entity, entity_id, op) VALUES ('{table}', old.{key}, 'update');
+            INSERT INTO change_log (entity, entity_id, op) SELECT '{table}', new.{key}, 'update' WHERE new.{key} IS NOT old.{key};
+        END
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_log_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO change_log (entity, entity_id, op) VALUES ('{table}', old.{key}, 'delete');
+        END
+        ''')
+
+
+def create_backup_journal(conn):
+    """ Create backup_journal and the triggers that record the key of every written row in it
+
+    key2 is only used by enrollments. A row with a NULL key1 means the table
+    was rewritten without the triggers, so the next backup must be full.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS backup_journal (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT,
+        key1 TEXT,
+        key2 TEXT
+    )
+    ''')
+    # Random ID telling backups of this database from backups of another one
+    conn.execute("CREATE TABLE IF NOT EXISTS backup_source (database_id TEXT)")
+    conn.execute("INSERT INTO backup_source (database_id) SELECT lower(hex(randomblob(16))) "
+                 "WHERE NOT EXISTS (SELECT 1 FROM backup_source)")
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS backup_journal_trim AFTER INSERT ON backup_journal BEGIN
+        DELETE FROM backup_journal WHERE seq <= new.seq - {BACKUP_JOURNAL_SIZE};
+    END
+    ''')
+    for table, keys in JOURNALED_TABLES:
+        def values(row):
+            return ", ".join(f"{row}.{key}" for key in keys) + ("" if len(keys) == 2 else ", NULL")
+        changed = " OR ".join(f"new.{key} IS NOT old.{key}" for key in keys)
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_journal_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO backup_journal (entity, key1, key2) VALUES ('{table}', {values("new")});
+        END
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_journal_au AFTER UPDATE ON {table} BEGIN
+            INSERT INTO backup_journal (entity, key1, key2) VALUES ('{table}', {values("old")});
+            INSERT INTO backup_journal (entity, key1, key2) SELECT '{table}', {values("new")} WHERE {changed};
+        END
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_journal_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO backup_journal (entity, key1, key2) VALUES ('{table}', {values("old")});
+        END
+        ''')
+
+
+def mark_journal_reset(conn):
+    """ Record that every journaled table was rewritten, so the next backup is a full one """
+    conn.executemany("INSERT INTO backup_journal (entity, key1, key2) VALUES (?, NULL, NULL)",
+                     [(table,) for table, _ in JOURNALED_TABLES])
+
+
+def database_id(conn):
+    return conn.execute("SELECT database_id FROM backup_source").fetchone()[0]
+
+
+def last_journal_seq(conn):
+    """ Return the sequence number of the newest backup_journal entry, including trimmed ones (0 when none) """
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'backup_journal'").fetchone()
+    return row[0] if row else 0
+
+
+def last_change(conn):
+    """ Return the sequence number of the newest change_log entry (0 when empty) """
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+
+def changed_entities(conn, seq):
+    """ Return (newest seq, tables changed after seq); every logged table if seq is no longer in the log """
+    newest = last_change(conn)
+    oldest = conn.execute("SELECT MIN(seq) FROM change_log").fetchone()[0]
+    # A restored snapshot can also bring back an older, shorter log
+    if newest < seq or (oldest is not None and oldest > seq + 1):
+        return newest, {table for table, _ in LOGGED_TABLES}
+    return newest, {row[0] for row in conn.execute("SELECT DISTINCT entity FROM change_log WHERE seq > ?", (seq,))}
+
+
+def create_search_indexes(conn):
+    """ Create the FTS5 search indexes and the triggers that keep them current """
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for index, table, columns in SEARCH_INDEXES:
+        cols = ", ".join(columns)
+        new_cols = ", ".join("new." + c for c in columns)
+        old_cols = ", ".join("old." + c for c in columns)
+        conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(
+            {cols}, content='{table}', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+        )
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {index}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {index}(rowid, {cols}) VALUES (new.rowid, {new_cols});
+        END
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {index}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {index}({index}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+        END
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {index}_au AFTER UPDATE ON {table} BEGIN
+            INSERT INTO {index}({index}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+            INSERT INTO {index}(rowid, {cols}) VALUES (new.rowid, {new_cols});
+        END
+        ''')
+        if index not in existing:
+            conn.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+
+
+def rebuild_search_indexes(conn):
+    """ Re-index every table, needed when rowids may have changed (e.g. after VACUUM) """
+    for index, _, _ in SEARCH_INDEXES:
+        conn.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+
+
+def index_rows_after(conn, table, rowid):
+    """ Add the rows of table past rowid to its search index, for inserts made with its insert trigger dropped """
+    for index, indexed_table, columns in SEARCH_INDEXES:
+        if indexed_table == table:
+            cols = ", ".join(columns)
+            conn.execute(f"INSERT INTO {index}(rowid, {cols}) SELECT rowid, {cols} FROM {table} WHERE rowid > ?", (rowid,))
+
+
+def create_stats(conn):
+    """ Create the count tables and the triggers that keep them current
+
+    course_stats holds the students enrolled in each course, instructor_stats
+    the courses each instructor teaches and table_totals the rows of each
+    school table, so none of them needs a COUNT(*) to read.
+    """
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.execute("CREATE TABLE IF NOT EXISTS course_stats (course_id TEXT PRIMARY KEY, enrolled INTEGER NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS course_stats_enrolled ON course_stats (enrolled, course_id)")
+    conn.execute("CREATE TABLE IF NOT EXISTS instructor_stats (instructor_id TEXT PRIMARY KEY, courses INTEGER NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS instructor_stats_courses ON instructor_stats (courses, instructor_id)")
+    conn.execute("CREATE TABLE IF NOT EXISTS table_totals (entity TEXT PRIMARY KEY, total INTEGER NOT NULL)")
+
+    # (table, event) -> statements run for each row, besides counting the row in table_totals
+    statements = {
+        ("students", "INSERT"): [],
+        ("students", "DELETE"): [],
+        ("instructors", "INSERT"): [
+            "INSERT OR IGNORE INTO instructor_stats (instructor_id, courses) VALUES (new.instructor_id, 0);"],
+        ("instructors", "DELETE"): ["DELETE FROM instructor_stats WHERE instructor_id = old.instructor_id;"],
+        ("courses", "INSERT"): [
+            "INSERT OR IGNORE INTO course_stats (course_id, enrolled) VALUES (new.course_id, 0);",
+            "UPDATE instructor_stats SET courses = courses + 1 WHERE instructor_id = new.instructor_id;"],
+        ("courses", "DELETE"): [
+            "DELETE FROM course_stats WHERE course_id = old.course_id;",
+            "UPDATE instructor_stats SET courses = courses - 1 WHERE instructor_id = old.instructor_id;"],
+        ("courses", "UPDATE"): [
+            "UPDATE course_stats SET course_id = new.course_id "
+            "WHERE course_id = old.course_id AND new.course_id IS NOT old.course_id;",
+            "UPDATE instructor_stats SET courses = courses - 1 "
+            "WHERE instructor_id = old.instructor_id AND new.instructor_id IS NOT old.instructor_id;",
+            "UPDATE instructor_stats SET courses = courses + 1 "
+            "WHERE instructor_id = new.instructor_id AND new.instructor_id IS NOT old.instructor_id;"],
+        ("enrollments", "INSERT"): ["UPDATE course_stats SET enrolled = enrolled + 1 WHERE course_id = new.course_id;"],
+        ("enrollments", "DELETE"): ["UPDATE course_stats SET enrolled = enrolled - 1 WHERE course_id = old.course_id;"],
+        ("enrollments", "UPDATE"): [
+            "UPDATE course_stats SET enrolled = enrolled - 1 "
+            "WHERE course_id = old.course_id AND new.course_id IS NOT old.course_id;",
+            "UPDATE course_stats SET enrolled = enrolled + 1 "
+            "WHERE course_id = new.course_id AND new.course_id IS NOT old.course_id;"],
+    }
+    for (table, event), body in statements.items():
+        if event != "UPDATE":
+            step = "+ 1" if event == "INSERT" else "- 1"
+            body = [f"UPDATE table_totals SET total = total {step} WHERE entity = '{table}';"] + body
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_stats_{event[0].lower()} AFTER {event} ON {table} BEGIN
+            {" ".join(body)}
+        END
+        ''')
+    if "table_totals" not in existing:
+        rebuild_stats(conn)
+
+
+def rebuild_stats(conn):
+    """ Recount the count tables from scratch """
+    conn.execute("DELETE FROM course_stats")
+    conn.execute("INSERT INTO course_stats (course_id, enrolled) "
+                 "SELECT course_id, (SELECT COUNT(*) FROM enrollments WHERE course_id = courses.course_id) FROM courses")
+    conn.execute("DELETE FROM instructor_stats")
+    conn.execute("INSERT INTO instructor_stats (instructor_id, courses) SELECT instructor_id, "
+                 "(SELECT COUNT(*) FROM courses WHERE instructor_id = instructors.instructor_id) FROM instructors")
+    conn.execute("DELETE FROM table_totals")
+    for table in TABLES:
+        conn.execute(f"INSERT INTO table_totals (entity, total) SELECT '{table}', COUNT(*) FROM {table}")
+
+
+def rebuild_derived(conn):
+    """ Recompute everything the triggers maintain, after writes made with the triggers dropped
+
+    The backup journal cannot be recomputed; it is marked so the next
+    backup is a full one.
+    """
+    rebuild_search_indexes(conn)
+    rebuild_stats(conn)
+    mark_journal_reset(conn)
+
+
+def oversold_courses(conn, limit=5):
+    """ Return (course_id, enrolled, capacity) for the courses holding more students than their capacity """
+    return conn.execute("SELECT course_id, enrolled, capacity FROM course_stats JOIN courses USING (course_id) "
+                        "WHERE enrolled > capacity ORDER BY course_id LIMIT ?", (limit,)).fetchall()
+
+
+def read_summary(conn, top=3):
+    """ Return (rows per table, the top fullest courses, the top busiest instructors) from the count tables
+
+    Courses are (course_id, course_name, enrolled, capacity) and
+    instructors (instructor_id, name, courses).
+    """
+    totals = dict(conn.execute("SELECT entity, total FROM table_totals"))
+    fullest = conn.execute(
+        "SELECT course_id, course_name, enrolled, capacity FROM course_stats JOIN courses USING (course_id) "
+        "ORDER BY enrolled DESC, course_id DESC LIMIT ?", (top,)).fetchall()
+    busiest = conn.execute(
+        "SELECT instructor_id, name, courses FROM instructor_stats JOIN instructors USING (instructor_id) "
+        "ORDER BY courses DESC, instructor_id DESC LIMIT ?", (top,)).fetchall()
+    return totals, fullest, busiest
+
+
+def search_terms(text):
+    """ Split text into lowercase words without diacritics, like the FTS5 tokenizer does """
+    text = unicodedata.normalize("NFKD", text.lower())
+    # unicode61 splits on "_" too, so it is not part of a word here either
+    return re.findall(r"[^\W_]+", "".join(c for c in text if not unicodedata.combining(c)))
+
+
+def match_expression(columns, query):
+    """ Turn user input into an FTS5 prefix query limited to some columns, or None if empty """
+    terms = search_terms(query)
+    if not terms:
+        return None
+    return "{" + " ".join(columns) + "} : (" + " ".join(f'"{term}"*' for term in terms) + ")"
+
+
+def text_matches(text, query):
+    """ Same test as the FTS5 prefix query, applied to a string in Python """
+    words = search_terms(text)
+    return all(any(word.startswith(term) for word in words) for term in search_terms(query))
+
+
+def match_query(index, table, columns, query, select):
+    """ Return (sql, params) selecting rows whose columns match query plus a rank column """
+    select = ", ".join(f"{table}.{column}" for column in select)
+    expression = match_expression(columns, query)
+    if expression is None:
+        return f"SELECT {select}, 0 AS rank FROM {table}", ()
+    return (f"SELECT {select}, {index}.rank AS rank FROM {index} JOIN {table} ON {table}.rowid = {index}.rowid "
+            f"WHERE {index} MATCH ?", (expression,))
+
+
+def iter_search(conn, criteria, query, limit=None, offset=0, chunk_size=SEARCH_CHUNK_SIZE):
+    """ Yield chunks of matched records, best matches first
+
+    Each record is a (text, lines) pair: text holds the searched columns so
+    the record can be re-tested with text_matches, lines are its display
+    lines (a course comes with one line per enrolled student). limit and
+    offset count records, not lines.
+    """
+    if criteria in ("Name", "ID", "Email"):
+        student_column, instructor_column = {
+            "Name": ("name", "name"),
+            "ID": ("student_id", "instructor_id"),
+            "Email": ("email", "email"),
+        }[criteria]
+        student_sql, student_params = match_query("students_fts", "students", [student_column], query,
+                                                  ("student_id", "name", student_column + " AS text"))
+        instructor_sql, instructor_params = match_query("instructors_fts", "instructors", [instructor_column], query,
+                                                        ("instructor_id", "name", instructor_column + " AS text"))
+        cursor = conn.execute(f'''
+        SELECT kind, id, name, text FROM (
+            SELECT 0 AS kind, student_id AS id, name, text, rank FROM ({student_sql})
+            UNION ALL
+            SELECT 1 AS kind, instructor_id AS id, name, text, rank FROM ({instructor_sql})
+        )
+        ORDER BY kind, rank LIMIT ? OFFSET ?
+        ''', student_params + instructor_params + (-1 if limit is None else limit, offset))
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [(text or "", [f"{'Instructor' if kind else 'Student'}: {name}, ID: {record_id}"])
+                   for kind, record_id, name, text in rows]
+
+    elif criteria == "Course":
+        course_sql, course_params = match_query("courses_fts", "courses", ["course_name", "course_id"], query,
+                                                ("course_id", "course_name", "instructor_id"))
+        cursor = conn.execute(f'''
+        WITH matched AS (
+            SELECT course_id, course_name, instructor_id, rank FROM ({course_sql})
+            ORDER BY rank, course_id LIMIT ? OFFSET ?
+        )
+        SELECT m.course_id, m.course_name, m.instructor_id, s.name, s.student_id
+        FROM matched m
+        LEFT JOIN enrollments e ON e.course_id = m.course_id
+        LEFT JOIN students s ON s.student_id = e.student_id
+        ORDER BY m.rank, m.course_id
+        ''', course_params + (-1 if limit is None else limit, offset))
+
+        current_course = None
+        records = []
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for course_id, course_name, instructor_id, student_name, student_id in rows:
+                if course_id != current_course:
+                    current_course = course_id
+                    records.append((f"{course_name or ''} {course_id}",
+                                    [f"Course: {course_name} (ID: {course_id}), Instructor: {instructor_id}"]))
+                if student_id is not None:
+                    records[-1][1].append(f" - Student: {student_name}, ID: {student_id}")
+            # The last course may still have students in the next chunk
+            if len(records) > 1:
+                yield records[:-1]
+                records = records[-1:]
+        if records:
+            yield records
+    else:
+        raise ValueError("Please select a valid search criterion!")
+
+
+def search(conn, criteria, query, limit=None, offset=0):
+    """ Return the search result lines for the given criteria """
+    search_results = []
+    for records in iter_search(conn, criteria, query, limit, offset):
+        for _, lines in records:
+            search_results += lines
+    return search_results
+
+
+def stream_search(conn, criteria, query, on_chunk, limit=None, offset=0):
+    """ Pass each chunk of records to on_chunk as soon as it is read; return the number of records """
+    total = 0
+    for records in iter_search(conn, criteria, query, limit, offset):
+        on_chunk(records)
+        total += len(records)
+    return total
+
+
+# Keyset pagination over each table: (table, key column, selected columns)
+PAGE_QUERIES = {
+    "Students": ("students", "student_id", "student_id, name"),
+    "Instructors": ("instructors", "instructor_id", "instructor_id, name"),
+    "Courses": ("courses", "course_id", "course_id, course_name, instructor_id"),
+}
+
+
+# Orders of the course list: (ORDER BY, keyset condition on the row of the last course shown)
+COURSE_ORDERS = {
+    "ID": ("course_id", "course_id > :after"),
+    "Name": ("COALESCE(course_name, ''), course_id",
+             "(COALESCE(course_name, ''), course_id) > "
+             "((SELECT COALESCE(course_name, '') FROM courses WHERE course_id = :after), :after)"),
+    "Most enrolled": ("enrolled DESC, course_id DESC",
+                      "(enrolled, course_id) < ((SELECT enrolled FROM course_stats WHERE course_id = :after), :after)"),
+    "Fewest enrolled": ("enrolled, course_id",
+                        "(enrolled, course_id) > ((SELECT enrolled FROM course_stats WHERE course_id = :after), :after)"),
+}
+
+
+def list_courses(conn, order="ID", after_key=None, limit=200):
+    """ Return up to limit (course_id, course_name, enrolled, capacity) rows in a COURSE_ORDERS order,
+    starting after the course after_key """
+    order_by, condition = COURSE_ORDERS[order]
+    where = "" if after_key is None else f"WHERE {condition}"
+    return conn.execute(f"SELECT course_id, course_name, enrolled, capacity FROM course_stats JOIN courses USING (course_id) "
+                        f"{where} ORDER BY {order_by} LIMIT :limit", {"after": after_key, "limit": limit}).fetchall()
+
+
+def list_page(conn, category, after_key=None, limit=200):
+    """ Return up to limit rows of a category ordered by key, starting after after_key """
+    table, key, columns = PAGE_QUERIES[category]
+    if after_key is None:
+        return conn.execute(f"SELECT {columns} FROM {table} ORDER BY {key} LIMIT ?", (limit,)).fetchall()
+    return conn.execute(f"SELECT {columns} FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?",
+                        (after_key, limit)).fetchall()
+
+
+def list_window(conn, category, first_key, limit):
+    """ Return up to limit rows of a category ordered by key, starting at first_key """
+    table, key, columns = PAGE_QUERIES[category]
+    return conn.execute(f"SELECT {columns} FROM {table} WHERE {key} >= ? ORDER BY {key} LIMIT ?",
+                        (first_key, limit)).fetchall()
+
+
+def list_page_before(conn, category, before_key=None, limit=200):
+    """ Return the last limit rows of a category before before_key (or the end), in key order """
+    table, key, columns = PAGE_QUERIES[category]
+    if before_key is None:
+        rows = conn.execute(f"SELECT {columns} FROM {table} ORDER BY {key} DESC LIMIT ?", (limit,)).fetchall()
+    else:
+        rows = conn.execute(f"SELECT {columns} FROM {table} WHERE {key} < ? ORDER BY {key} DESC LIMIT ?",
+                            (before_key, limit)).fetchall()
+    rows.reverse()
+    return rows
+
+
+def list_at(conn, category, offset, limit):
+    """ Return up to limit rows of a category starting at a position in key order """
+    table, key, columns = PAGE_QUERIES[category]
+    return conn.execute(f"SELECT {columns} FROM {table} ORDER BY {key} LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+
+
+def count_records(conn, category):
+    table, _, _ = PAGE_QUERIES[category]
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def is_locked(error):
+    return "locked" in str(error) or "busy" in str(error)
+
+
+def immediate(conn, fn, *args, **kwargs):
+    """ Run fn(conn, *args, **kwargs) in a BEGIN IMMEDIATE transaction and commit it
+
+    The write lock is taken before fn reads anything, so what fn checks
+    cannot change before it writes, even with other processes writing the
+    same file. If the lock is still held by another process after
+    BUSY_TIMEOUT, the transaction is rolled back and retried up to
+    WRITE_RETRIES times with randomized exponential backoff. Called inside
+    an open transaction, fn just runs as part of it.
+    """
+    if conn.in_transaction:
+        return fn(conn, *args, **kwargs)
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = fn(conn, *args, **kwargs)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if attempt == WRITE_RETRIES or not is_locked(e):
+                raise
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        time.sleep(random.uniform(0.5, 1.0) * min(RETRY_BACKOFF * 2 ** attempt, RETRY_BACKOFF_MAX))
+
+
+def insert_record(conn, sql, values, duplicate_message, missing_parent_message=None):
+    """ Insert one row and let the table's constraints detect conflicts, raising them as ValueError """
+    try:
+        conn.execute(sql, values)
+    except sqlite3.IntegrityError as e:
+        if "UNIQUE" in str(e):
+            raise ValueError(duplicate_message)
+        if "FOREIGN KEY" in str(e) and missing_parent_message:
+            raise ValueError(missing_parent_message)
+        raise
+
+
+def add_student(conn, student_id, name, age, email, course_ids):
+    """ Insert a student and enroll them in the given courses; raise ValueError if the student is invalid """
+    _, errors = register_students(conn, [(student_id, name, age, email, course_ids)])
+    if errors:
+        raise ValueError(errors[0][1])
+
+
+def existing_keys(conn, table, key, values, chunk_size=500):
+    """ Return the subset of values present in the key column of table """
+    values = list(values)
+    found = set()
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        found.update(row[0] for row in conn.execute(
+            f"SELECT {key} FROM {table} WHERE {key} IN ({', '.join('?' * len(chunk))})", chunk))
+    return found
+
+
+def open_seats(conn, course_ids, chunk_size=500):
+    """ Return {course_id: seats left, or None without a capacity} for the courses that exist """
+    course_ids = list(course_ids)
+    seats = {}
+    for start in range(0, len(course_ids), chunk_size):
+        chunk = course_ids[start:start + chunk_size]
+        for course_id, capacity, enrolled in conn.execute(
+                f"SELECT course_id, capacity, (SELECT COUNT(*) FROM enrollments WHERE course_id = courses.course_id) "
+                f"FROM courses WHERE course_id IN ({', '.join('?' * len(chunk))})", chunk):
+            seats[course_id] = None if capacity is None else max(capacity - enrolled, 0)
+    return seats
+
+
+def check_student(student_id, name, age, email, course_ids):
+    """ Return the student's fields cleaned up, or raise ValueError if one is missing or malformed """
+    student_id, name, email = (str(value or "").strip() for value in (student_id, name, email))
+    course_ids = list(dict.fromkeys(str(course_id).strip() for course_id in course_ids or () if course_id))
+    if not (student_id and name and email and course_ids):
+        raise ValueError("All fields are required!")
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        raise ValueError("Age must be a valid number!")
+    return student_id, name, age, email, course_ids
+
+
+def register_students(conn, students, first_row=1):
+    """ Insert many (student_id, name, age, email, course_ids) students with their enrollments
+
+    Rows are validated together: duplicate IDs in the batch or the database,
+    unknown or full courses and missing or malformed fields reject only
+    their own row. The database checks and the inserts run in one BEGIN
+    IMMEDIATE transaction (see immediate), so concurrent registrations
+    cannot take the same ID or seat. The valid rows are inserted with
+    executemany. Returns the number registered and a list of (row number,
+    error) for the rejected rows, numbered from first_row.
+    """
+    candidates = []
+    errors = []
+    seen = set()
+    for number, student in enumerate(students, first_row):
+        try:
+            student_id, name, age, email, course_ids = check_student(*student)
+        except ValueError as e:
+            errors.append((number, str(e)))
+            continue
+        if student_id in seen:
+            errors.append((number, "A student with this ID appears more than once!"))
+            continue
+        seen.add(student_id)
+        candidates.append((number, (student_id, name, age, email), course_ids))
+
+    registered, rejected = immediate(conn, insert_students, candidates)
+    errors = sorted(errors + rejected)
+    return registered, errors
+
+
+def insert_students(conn, candidates):
+    """ Insert the validated (row number, student, course_ids) candidates that the database accepts """
+    errors = []
+    taken = existing_keys(conn, "students", "student_id", [student[0] for _, student, _ in candidates])
+    seats = open_seats(conn, {course_id for _, _, course_ids in candidates for course_id in course_ids})
+    students_rows = []
+    enrollment_rows = []
+    for number, student, course_ids in candidates:
+        unknown = [course_id for course_id in course_ids if course_id not in seats]
+        full = [course_id for course_id in course_ids if seats.get(course_id) == 0]
+        if student[0] in taken:
+            errors.append((number, "A student with this ID already exists!"))
+        elif unknown:
+            errors.append((number, f"Unknown course: {', '.join(unknown)}"))
+        elif full:
+            errors.append((number, f"Course is full: {', '.join(full)}"))
+        else:
+            for course_id in course_ids:
+                if seats[course_id] is not None:
+                    seats[course_id] -= 1
+            students_rows.append(student)
+            enrollment_rows += [(student[0], course_id) for course_id in course_ids]
+
+    conn.executemany("INSERT INTO students (student_id, name, age, email) VALUES (?, ?, ?, ?)", students_rows)
+    conn.executemany("INSERT INTO enrollments (student_id, course_id) VALUES (?, ?)", enrollment_rows)
+    return len(students_rows), errors
+
+
+def check_instructor(instructor_id, name, age, email):
+    """ Return the instructor's fields with age as a number, or raise ValueError if one is missing or malformed """
+    if not (name and instructor_id and email):
+        raise ValueError("All fields are required!")
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        raise ValueError("Age must be a valid number!")
+    return instructor_id, name, age, email
+
+
+def add_instructor(conn, instructor_id, name, age, email):
+    """ Insert an instructor; raise ValueError if the instructor is invalid """
+    instructor_id, name, age, email = check_instructor(instructor_id, name, age, email)
+    immediate(conn, insert_record, "INSERT INTO instructors (instructor_id, name, age, email) VALUES (?, ?, ?, ?)",
+              (instructor_id, name, age, email), "An instructor with this ID already exists!")
+
+
+def check_course(course_id, course_name, instructor_id, capacity=None):
+    """ Return the course's fields with capacity as a number or None, or raise ValueError if one is malformed """
+    if not (course_name and course_id and instructor_id):
+        raise ValueError("All fields are required!")
+    if capacity in (None, ""):
+        capacity = None
+    else:
+        try:
+            capacity = int(capacity)
+        except (TypeError, ValueError):
+            raise ValueError("Capacity must be a valid number!")
+        if capacity < 0:
+            raise ValueError("Capacity cannot be negative!")
+    return course_id, course_name, instructor_id, capacity
+
+
+def add_course(conn, course_id, course_name, instructor_id, capacity=None):
+    """ Insert a course taught by the instructor with the given ID, taking at most capacity students if given """
+    course_id, course_name, instructor_id, capacity = check_course(course_id, course_name, instructor_id, capacity)
+    immediate(conn, insert_record, "INSERT INTO courses (course_id, course_name, instructor_id, capacity) "
+              "VALUES (?, ?, ?, ?)", (course_id, course_name, instructor_id, capacity),
+              "A course with this ID already exists!", "The selected instructor does not exist!")
+
+
+# Form submissions by kind, as queued by write_buffer.WriteBuffer: the check and the insert function
+SUBMISSIONS = {
+    "student": (check_student, add_student),
+    "instructor": (check_instructor, add_instructor),
+    "course": (check_course, add_course),
+}
+
+
+def apply_submissions(conn, submissions, replayed=0):
+    """ Insert queued (kind, values) form submissions in one transaction; return [(index, error)] for the rejected
+
+    Each run of consecutive students is registered together with
+    register_students; instructors and courses run in their own savepoint,
+    so a rejected submission leaves nothing behind and does not stop the
+    others. The first replayed submissions come from a queue file left by a
+    crash; one whose record already exists was committed before the crash
+    and is skipped.
+    """
+    def insert_all(conn):
+        errors = []
+        start = 0
+        while start < len(submissions):
+            kind = submissions[start][0]
+            end = start + 1
+            if kind == "student":
+                while end < len(submissions) and submissions[end][0] == "student":
+                    end += 1
+                _, rejected = register_students(conn, [values for _, values in submissions[start:end]], start)
+            else:
+                rejected = []
+                conn.execute("SAVEPOINT submission")
+                try:
+                    SUBMISSIONS[kind][1](conn, *submissions[start][1])
+                except (ValueError, sqlite3.IntegrityError) as e:
+                    conn.execute("ROLLBACK TO submission")
+                    rejected.append((start, str(e)))
+                conn.execute("RELEASE submission")
+            errors += [(index, error) for index, error in rejected
+                       if index >= replayed or "already exists" not in error]
+            start = end
+        return errors
+
+    return immediate(conn, insert_all)
+
+
+def delete_records(conn, category, record_ids):
+    """ Delete the records of a category with the given IDs in one statement; return how many were deleted
+
+    The IDs go through a temporary table so any number can be deleted at
+    once. Enrollments, and an instructor's courses, go with their parent
+    through ON DELETE CASCADE.
+    """
+    table, key, _ = PAGE_QUERIES[category]
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS delete_ids (id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.delete_ids")
+    conn.executemany("INSERT OR IGNORE INTO temp.delete_ids (id) VALUES (?)", [(record_id,) for record_id in record_ids])
+    deleted = conn.execute(f"DELETE FROM {table} WHERE {key} IN (SELECT id FROM temp.delete_ids)").rowcount
+    conn.execute("DELETE FROM temp.delete_ids")
+    return deleted
+
+
+def clear_all(conn):
+    """ Delete every record, children first """
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM enrollments")
+    cursor.execute("DELETE FROM courses")
+    cursor.execute("DELETE FROM students")
+    cursor.execute("DELETE FROM instructors")
@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import json
+import sqlite3
+import time
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import school_db
+import data_transfer
+from db_worker import DatabaseWorker
+from connection_pool import ConnectionPool
+from query_metrics import QueryMetrics, SLOW_QUERY_SUFFIX
+from roster_index import RosterIndex, ROSTER_CRITERIA
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+# Largest page a list request may ask for, and the page size when it does not ask
+MAX_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = 100
+# Largest request body accepted, in bytes (bulk registrations are the big ones)
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+# URL collection -> category of school_db.PAGE_QUERIES
+COLLECTIONS = {"students": "Students", "instructors": "Instructors", "courses": "Courses"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class SchoolService:
+    """ Local HTTP JSON API over the school database
+
+    Every request runs its school_db or data_transfer function on the
+    DatabaseWorker, so reads from many clients proceed in parallel while
+    writes are serialized, exactly as in the GUI.
+
+        GET    /students?after=KEY&limit=N        one page of records, ordered by ID
+        POST   /students                          add a student, or register a JSON array of them
+        DELETE /students/ID                       delete one record
+        DELETE /students  {"ids": [...]}          delete many records
+        GET    /search?criteria=Name&q=TEXT       matching records, streamed as JSON Lines
+        GET    /search?criteria=Roster query&q=C1 and C2    set queries over enrollments (roster_index)
+        GET    /metrics                           statement and request latencies (query_metrics)
+        POST   /save  {"filename": ...}           export_file on the server's disk
+        POST   /load  {"filename": ..., "mode": ...}     also restores a backup manifest.json
+        POST   /load  {"filenames": [...], "mode": ...}  shards loaded in parallel (data_transfer.import_files)
+        POST   /backup  {"directory": ...}        incremental backup (data_transfer.backup)
+
+    instructors and courses work like students.
+    """
+
+    def __init__(self, db, metrics=None):
+        self.db = db
+        self.metrics = metrics
+        self.roster = RosterIndex()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                started = time.perf_counter()
+                try:
+                    await self.dispatch(writer, method, target, body)
+                except HttpError as e:
+                    await send_json(writer, e.status, {"error": str(e)})
+                except ValueError as e:
+                    await send_json(writer, HTTPStatus.BAD_REQUEST, {"error": str(e)})
+                except sqlite3.IntegrityError as e:
+                    await send_json(writer, HTTPStatus.CONFLICT, {"error": str(e)})
+                except (sqlite3.Error, OSError) as e:
+                    await send_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+                if self.metrics is not None:
+                    resource = urlsplit(target).path.strip("/").split("/")[0]
+                    self.metrics.record_action(f"{method} /{resource}", time.perf_counter() - started)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except HttpError as e:
+            await send_json(writer, e.status, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, writer, method, target, body):
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+
+        if parts and parts[0] in COLLECTIONS and len(parts) <= 2:
+            category = COLLECTIONS[parts[0]]
+            if method == "GET" and len(parts) == 1:
+                return await send_json(writer, HTTPStatus.OK, await self.list_page(category, query))
+            if method == "POST" and len(parts) == 1:
+                status, result = await self.create(category, parse_body(body, allow_list=True))
+                return await send_json(writer, status, result)
+            if method == "DELETE":
+                ids = parts[1:] or parse_body(body).get("ids")
+                if not isinstance(ids, list) or not ids:
+                    raise ValueError("Give the IDs to delete as a non-empty \"ids\" list")
+                deleted = await self.write(school_db.delete_records, category, ids)
+                if len(parts) == 2 and not deleted:
+                    raise HttpError(HTTPStatus.NOT_FOUND, f"No {category.lower()[:-1]} with ID {parts[1]}")
+                return await send_json(writer, HTTPStatus.OK, {"deleted": deleted})
+        elif parts == ["metrics"] and method == "GET" and self.metrics is not None:
+            return await send_json(writer, HTTPStatus.OK, self.metrics.snapshot())
+        elif parts == ["search"] and method == "GET":
+            return await self.stream_search(writer, query)
+        elif parts == ["save"] and method == "POST":
+            filename = parse_body(body).get("filename")
+            if not filename:
+                raise ValueError("Give the file to save to as \"filename\"")
+            await self.read(data_transfer.export_file, filename)
+            return await send_json(writer, HTTPStatus.OK, {"saved": filename})
+        elif parts == ["backup"] and method == "POST":
+            directory = parse_body(body).get("directory")
+            if not directory:
+                raise ValueError("Give the folder to back up to as \"directory\"")
+            kind, filename, records = await self.read(data_transfer.backup, directory)
+            return await send_json(writer, HTTPStatus.OK, {"kind": kind, "file": filename, "records": records})
+        elif parts == ["load"] and method == "POST":
+            request = parse_body(body)
+            if isinstance(request.get("filenames"), list) and request["filenames"]:
+                reports = await self.write(data_transfer.import_files, request["filenames"],
+                                           request.get("mode", "replace"))
+                return await send_json(writer, HTTPStatus.OK, {"loaded": reports})
+            if not request.get("filename"):
+                raise ValueError("Give the file to load as \"filename\", or shards as a \"filenames\" list")
+            await self.write(data_transfer.import_file, request["filename"], request.get("mode", "replace"))
+            return await send_json(writer, HTTPStatus.OK, {"loaded": request["filename"]})
+        raise HttpError(HTTPStatus.NOT_FOUND, f"No route for {method} {url.path}")
+
+    async def read(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.db.submit_read(fn, *args, **kwargs))
+
+    async def write(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.db.submit_write(fn, *args, **kwargs))
+
+    async def list_page(self, category, query):
+        limit = int(query.get("limit", DEFAULT_PAGE_SIZE))
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        rows = await self.read(school_db.list_page, category, query.get("after"), limit)
+        columns = [column.strip() for column in school_db.PAGE_QUERIES[category][2].split(",")]
+        return {
+            "items": [dict(zip(columns, row)) for row in rows],
+            "next": rows[-1][0] if len(rows) == limit else None,
+        }
+
+    async def create(self, category, record):
+        if category == "Students" and isinstance(record, list):
+            rows = [(item.get("student_id"), item.get("name"), item.get("age"), item.get("email"), item.get("course_ids"))
+                    for item in record if isinstance(item, dict)]
+            if len(rows) != len(record):
+                raise ValueError("Every student must be a JSON object")
+            registered, errors = await self.write(school_db.register_students, rows, first_row=0)
+            return HTTPStatus.OK, {"registered": registered,
+                                   "errors": [{"index": index, "error": error} for index, error in errors]}
+        if not isinstance(record, dict):
+            raise ValueError("Expected a JSON object")
+        if category == "Students":
+            await self.write(school_db.add_student, record.get("student_id"), record.get("name"), record.get("age"),
+                             record.get("email"), record.get("course_ids") or [])
+        elif category == "Instructors":
+            await self.write(school_db.add_instructor, record.get("instructor_id"), record.get("name"),
+                             record.get("age"), record.get("email"))
+        else:
+            await self.write(school_db.add_course, record.get("course_id"), record.get("course_name"),
+                             record.get("instructor_id"), record.get("capacity"))
+        return HTTPStatus.CREATED, record
+
+    async def stream_search(self, writer, query):
+        """ Send each chunk of matches as soon as the reader thread has it, one JSON line per record """
+        limit = int(query["limit"]) if "limit" in query else None
+        offset = int(query.get("offset", 0))
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+
+        def on_chunk(records):
+            loop.call_soon_threadsafe(chunks.put_nowait, records)
+
+        if query.get("criteria") == ROSTER_CRITERIA:
+            future = self.db.submit_read(self.roster.stream_query, query.get("q", ""), on_chunk, limit, offset)
+        else:
+            future = self.db.submit_read(school_db.stream_search, query.get("criteria", ""), query.get("q", ""),
+                                         on_chunk, limit, offset)
+        # Scheduled after every on_chunk call, so None always arrives last
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(chunks.put_nowait, None))
+        try:
+            records = await chunks.get()
+            if records is None:
+                future.result()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                         b"Transfer-Encoding: chunked\r\n\r\n")
+            while records is not None:
+                data = "".join(json.dumps({"lines": lines}) + "\n" for _, lines in records).encode()
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                await writer.drain()
+                records = await chunks.get()
+            if future.exception() is not None:
+                # Too late for an error status: end the connection without the final chunk
+                raise ConnectionAbortedError(str(future.exception()))
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            # Stops the query if the client went away mid-stream
+            future.cancel()
+
+
+def parse_body(body, allow_list=False):
+    """ The JSON object in a request body (or a JSON array, with allow_list); raise ValueError otherwise """
+    try:
+        value = json.loads(body or b"{}")
+    except ValueError:
+        raise ValueError("The request body is not valid JSON")
+    if not isinstance(value, dict) and not (allow_list and isinstance(value, list)):
+        raise ValueError("Expected a JSON object")
+    return value
+
+
+async def read_request(reader):
+    """ Read one HTTP/1.1 request; return (method, target, headers, body), or None at end of stream """
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_SIZE:
+        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+
+async def send_json(writer, status, value):
+    data = json.dumps(value).encode()
+    writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, path=school_db.DB_PATH):
+    metrics = QueryMetrics(slow_log=path + SLOW_QUERY_SUFFIX)
+    pool = ConnectionPool(path, metrics=metrics)
+    db = DatabaseWorker(pool=pool)
+    try:
+        db.submit_write(school_db.create_tables).result()
+        service = SchoolService(db, metrics)
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        print(f"Serving the school database on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+    finally:
+        db.close()
+        pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the school database as a local HTTP JSON API")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--db", default=school_db.DB_PATH, help="database file")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.db))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+from collections import OrderedDict
+
+from school_db import search_terms, text_matches
+
+
+class SearchCache:
+    """ Remembers complete search results so a refined query can be answered without the database
+
+    Results are stored per (criteria, query) as the (text, lines) records
+    returned by school_db.iter_search. A query that only narrows a cached
+    one (every cached term is a prefix of one of its terms) is answered by
+    filtering the cached records with text_matches.
+    """
+
+    def __init__(self, size=32):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def store(self, criteria, query, records):
+        key = (criteria, tuple(search_terms(query)))
+        self.entries[key] = records
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def lookup(self, criteria, query):
+        """ Return the records matching query, or None if the database has to be asked """
+        terms = search_terms(query)
+        key = (criteria, tuple(terms))
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        for (cached_criteria, cached_terms), records in reversed(self.entries.items()):
+            if cached_criteria == criteria and self.narrows(cached_terms, terms):
+                records = [record for record in records if text_matches(record[0], query)]
+                self.store(criteria, query, records)
+                return records
+        return None
+
+    def clear(self):
+        self.entries.clear()
+
+    @staticmethod
+    def narrows(cached_terms, terms):
+        return all(any(term.startswith(cached) for term in terms) for cached in cached_terms)
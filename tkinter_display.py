@@ -1,50 +1,231 @@
 import tkinter as tk
-from tkinter import Listbox, Button
+from tkinter import Listbox, Button, Label, Scrollbar, Frame
 import sqlite3
-from functools import partial
-def update_display(listboxes):
-    """ Update the listboxes with data from the database """
-    conn = sqlite3.connect('school_management.db')
-    cursor = conn.cursor()
-
-    student_listbox, instructor_listbox, course_listbox = listboxes
-
-    student_listbox.delete(0, tk.END)
-    cursor.execute("SELECT * FROM students")
-    students = cursor.fetchall()
-
-    for student in students:
-        student_listbox.insert(tk.END, f"{student[1]} (ID: {student[0]})")
-
-    instructor_listbox.delete(0, tk.END)
-    cursor.execute("SELECT * FROM instructors")
-    instructors = cursor.fetchall()
-    for instructor in instructors:
-        instructor_listbox.insert(tk.END, f"{instructor[1]} (ID: {instructor[0]})")
-    # I added this comment just to learn git 
-    course_listbox.delete(0, tk.END)
-    cursor.execute("SELECT * FROM courses")
-    courses = cursor.fetchall()
-    for course in courses:
-        course_listbox.insert(tk.END, f"{course[1]} (ID: {course[0]})")
-
-    conn.close()
-
-def create_tkinter_frame():
-    """ Create the Tkinter window and return the root and listboxes """
+import time
+import school_db
+from connection_pool import ConnectionPool
+
+# How often the display checks change_log for new writes
+POLL_MS = 500
+# Courses and instructors listed in the summary
+SUMMARY_TOP = 3
+
+class SqlSource:
+    """ Reads list windows straight from SQLite on pooled connections, for when no EntityCache is shared """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def list_page(self, category, after_key=None, limit=200):
+        with self.pool.reader() as conn:
+            return school_db.list_page(conn, category, after_key, limit)
+
+    def list_window(self, category, first_key, limit):
+        with self.pool.reader() as conn:
+            return school_db.list_window(conn, category, first_key, limit)
+
+    def list_page_before(self, category, before_key=None, limit=200):
+        with self.pool.reader() as conn:
+            return school_db.list_page_before(conn, category, before_key, limit)
+
+    def list_at(self, category, offset, limit):
+        with self.pool.reader() as conn:
+            return school_db.list_at(conn, category, offset, limit)
+
+    def count_records(self, category):
+        with self.pool.reader() as conn:
+            return school_db.count_records(conn, category)
+
+class VirtualListbox(Frame):
+    """ Listbox that only holds the rows in view and reads the others by key as it scrolls """
+
+    def __init__(self, master, category, height=6, width=40):
+        super().__init__(master)
+        self.category = category
+        self.table = school_db.PAGE_QUERIES[category][0]
+        self.height = height
+        self.source = None
+        self.rows = []
+        self.top = 0
+        self.total = 0
+
+        self.title = Label(self, anchor="w")
+        self.title.pack(fill=tk.X)
+        self.listbox = Listbox(self, height=height, width=width)
+        self.listbox.pack(side=tk.LEFT)
+        self.scrollbar = Scrollbar(self, command=self.on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.listbox.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        self.listbox.bind("<Button-4>", lambda e: self.scroll(-1))
+        self.listbox.bind("<Button-5>", lambda e: self.scroll(1))
+
+    def refresh(self):
+        """ Recount the table and re-read the rows in view, keeping the same first row """
+        self.total = self.source.count_records(self.category)
+        if self.rows:
+            rows = self.source.list_window(self.category, self.rows[0][0], self.height)
+        else:
+            rows = self.source.list_page(self.category, None, self.height)
+        if len(rows) < self.height:
+            self.show_end()
+        else:
+            self.show(rows)
+
+    def on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.move_to(float(amount))
+        elif action == "scroll":
+            self.scroll(int(amount) * (self.height if unit == "pages" else 1))
+
+    def scroll(self, lines):
+        if not self.rows:
+            return
+        if lines > 0:
+            rows = self.source.list_page(self.category, self.rows[-1][0], lines)
+            if len(rows) < lines:
+                self.show_end()
+                return
+            self.top += lines
+            self.show((self.rows + rows)[lines:])
+        else:
+            rows = self.source.list_page_before(self.category, self.rows[0][0], -lines)
+            self.top = max(self.top - len(rows), 0)
+            self.show((rows + self.rows)[:self.height])
+
+    def move_to(self, fraction):
+        offset = min(max(int(fraction * self.total), 0), max(self.total - self.height, 0))
+        self.top = offset
+        self.show(self.source.list_at(self.category, offset, self.height))
+
+    def show_end(self):
+        self.top = max(self.total - self.height, 0)
+        self.show(self.source.list_page_before(self.category, None, self.height))
+
+    def show(self, rows):
+        self.rows = rows
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *[f"{row[1]} (ID: {row[0]})" for row in rows])
+        self.title.config(text=f"{self.category} ({self.total})")
+        if self.total:
+            self.scrollbar.set(self.top / self.total, min((self.top + len(rows)) / self.total, 1.0))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+class SummaryPanel(Frame):
+    """ Record totals, the fullest courses and the busiest instructors, read from the count tables """
+
+    def __init__(self, master):
+        super().__init__(master)
+        self.text = Label(self, anchor="w", justify=tk.LEFT)
+        self.text.pack(fill=tk.X)
+
+    def refresh(self, pool):
+        with pool.reader() as conn:
+            totals, fullest, busiest = school_db.read_summary(conn, SUMMARY_TOP)
+        lines = [" | ".join(f"{table.capitalize()}: {totals.get(table, 0)}" for table in school_db.TABLES)]
+        lines.append("Fullest courses:")
+        lines += [f"  {name} (ID: {course_id}): {enrolled}" + (f" of {capacity}" if capacity is not None else "")
+                  + " students" for course_id, name, enrolled, capacity in fullest]
+        lines.append("Busiest instructors:")
+        lines += [f"  {name} (ID: {instructor_id}): {courses} courses" for instructor_id, name, courses in busiest]
+        self.text.config(text="\n".join(lines))
+
+def update_display(lists, source):
+    """ Update the lists with data from the source (an EntityCache or SqlSource) """
+    for virtual_list in lists:
+        virtual_list.source = source
+        virtual_list.refresh()
+
+class DisplaySync:
+    """ Keeps the lists current by refreshing the ones whose data changed
+
+    With a shared EntityCache the lists read from memory and follow the
+    cache's per-category versions; otherwise they read SQLite and follow
+    change_log.
+    """
+
+    def __init__(self, root, lists, cache=None, pool=None, summary=None):
+        self.root = root
+        self.lists = lists
+        self.summary = summary
+        self.cache = cache
+        self.pool = pool
+        self.last_seq = 0
+        self.versions = {}
+
+    def reload(self):
+        """ Redraw everything """
+        started = time.perf_counter()
+        if self.pool is None:
+            self.pool = ConnectionPool()
+        if self.cache is not None:
+            self.versions = dict(self.cache.versions)
+            update_display(self.lists, self.cache)
+        else:
+            with self.pool.reader() as conn:
+                self.last_seq = school_db.last_change(conn)
+            update_display(self.lists, SqlSource(self.pool))
+        if self.summary is not None:
+            self.summary.refresh(self.pool)
+        self.record_action("tk_reload", started)
+
+    def start(self):
+        self.root.after(POLL_MS, self.poll)
+
+    def poll(self):
+        started = time.perf_counter()
+        try:
+            if self.apply_changes():
+                self.record_action("tk_refresh", started)
+        except sqlite3.Error as e:
+            print(f"Error refreshing display: {e}")
+        self.root.after(POLL_MS, self.poll)
+
+    def apply_changes(self):
+        """ Refresh the lists (and summary) whose data changed since the last poll; return how many lists changed """
+        # Every write since the last poll collapses into one refresh per changed list
+        if self.cache is not None:
+            versions = dict(self.cache.versions)
+            changed = [virtual_list for virtual_list in self.lists
+                       if versions[virtual_list.category] != self.versions.get(virtual_list.category)]
+            self.versions = versions
+        else:
+            with self.pool.reader() as conn:
+                newest, tables = school_db.changed_entities(conn, self.last_seq)
+            self.last_seq = newest
+            changed = [virtual_list for virtual_list in self.lists if virtual_list.table in tables]
+        for virtual_list in changed:
+            virtual_list.refresh()
+        # Enrollments are not logged; they only change along with a logged student or course
+        if changed and self.summary is not None:
+            self.summary.refresh(self.pool)
+        return len(changed)
+
+    def record_action(self, name, started):
+        if self.pool is not None and self.pool.metrics is not None:
+            self.pool.metrics.record_action(name, time.perf_counter() - started)
+
+def create_tkinter_frame(cache=None, pool=None):
+    """ Create the Tkinter window and return the root and its DisplaySync """
     root = tk.Tk()
     root.title("Database Records")
-    root.geometry("400x400")
+    root.geometry("400x600")
+
+    student_list = VirtualListbox(root, "Students", height=6, width=40)
+    instructor_list = VirtualListbox(root, "Instructors", height=6, width=40)
+    course_list = VirtualListbox(root, "Courses", height=6, width=40)
+
+    student_list.pack(pady=5)
+    instructor_list.pack(pady=5)
+    course_list.pack(pady=5)
 
-    student_listbox = Listbox(root, height=6, width=40)
-    instructor_listbox = Listbox(root, height=6, width=40)
-    course_listbox = Listbox(root, height=6, width=40)
+    summary = SummaryPanel(root)
+    summary.pack(fill=tk.X, padx=10, pady=5)
 
-    student_listbox.pack(pady=5)
-    instructor_listbox.pack(pady=5)
-    course_listbox.pack(pady=5)
+    display = DisplaySync(root, (student_list, instructor_list, course_list), cache, pool, summary)
 
-    refresh_button = Button(root, text="Refresh", command=partial(update_display, (student_listbox, instructor_listbox, course_listbox)))
+    refresh_button = Button(root, text="Refresh", command=display.reload)
     refresh_button.pack(pady=10)
 
-    return root, (student_listbox, instructor_listbox, course_listbox)
+    return root, display
@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+
+import school_db
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Queued submissions are written this long after the first one, or as soon as FLUSH_SIZE are waiting
+FLUSH_MS = 250
+FLUSH_SIZE = 500
+# The queue file sits next to the database, like SQLite's own -wal file
+QUEUE_SUFFIX = "-pending.jsonl"
+
+# kind -> (cache category of the record, duplicate message)
+KINDS = {
+    "student": ("Students", "A student with this ID already exists!"),
+    "instructor": ("Instructors", "An instructor with this ID already exists!"),
+    "course": ("Courses", "A course with this ID already exists!"),
+}
+
+
+def lock_file(file):
+    """ Take an exclusive lock on an open file without waiting; return False if another process holds it """
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+class WriteBuffer:
+    """ Write-behind queue for form submissions, flushed in grouped transactions
+
+    add() checks a submission at once: its fields with the school_db
+    checks, and its ID and the courses or instructor it refers to against
+    the EntityCache and the submissions still queued. Accepted submissions
+    are appended to the database's queue file before add() returns, so the
+    ones not yet written survive the app crashing and are replayed at the
+    next start. take() hands the queued submissions to one
+    school_db.apply_submissions call; flushed() then appends a marker
+    dropping them, and empties the file once nothing is queued. The file
+    is only created by the first add(), and is locked by the process using
+    it, so a second window on the same database neither replays nor removes
+    it. Safe to use from any thread.
+    """
+
+    def __init__(self, cache, db_path=school_db.DB_PATH):
+        self.cache = cache
+        self.path = db_path + QUEUE_SUFFIX
+        self.lock = threading.Lock()
+        self.pending = []
+        self.flushing = []
+        self.keys = {category: set() for category, _ in KINDS.values()}
+        # Submissions read back from the queue file, at the front of pending (or of flushing)
+        self.replayed = 0
+        self.flushing_replayed = 0
+        self.file = None
+        if os.path.exists(self.path) and self.open():
+            self.recover()
+
+    def open(self):
+        """ Open and lock the queue file, creating it if needed; return False if another process holds it """
+        for _ in range(2):
+            file = open(self.path, "a+", encoding="utf-8")
+            if not lock_file(file):
+                file.close()
+                return False
+            # The holder removes the file before unlocking it; a lock on the removed file is worth nothing
+            if os.path.exists(self.path) and os.path.samestat(os.fstat(file.fileno()), os.stat(self.path)):
+                self.file = file
+                return True
+            file.close()
+        return False
+
+    def recover(self):
+        self.file.seek(0)
+        for line in self.file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line is cut short if the crash came mid-write
+                continue
+            if isinstance(entry, dict):
+                # {"flushed": n}: the first n queued submissions were committed
+                del self.pending[:entry["flushed"]]
+            else:
+                self.pending.append(tuple(entry))
+        for kind, values in self.pending:
+            self.keys[KINDS[kind][0]].add(values[0])
+        self.replayed = len(self.pending)
+
+    def add(self, kind, *values):
+        """ Check and queue one submission; raise ValueError if it is invalid. Returns how many are queued """
+        check, _ = school_db.SUBMISSIONS[kind]
+        values = list(check(*values))
+        category, duplicate_message = KINDS[kind]
+        with self.lock:
+            if self.exists(category, values[0]):
+                raise ValueError(duplicate_message)
+            if kind == "student":
+                unknown = [course_id for course_id in values[4] if not self.exists("Courses", course_id)]
+                if unknown:
+                    raise ValueError(f"Unknown course: {', '.join(unknown)}")
+            elif kind == "course" and not self.exists("Instructors", values[2]):
+                raise ValueError("The selected instructor does not exist!")
+            if self.file is None and not self.open():
+                raise ValueError("Another window is queueing writes to this database; "
+                                 "turn off Queue Form Writes or close that window")
+            self.file.write(json.dumps([kind, values]) + "\n")
+            self.file.flush()
+            self.pending.append((kind, values))
+            self.keys[category].add(values[0])
+            return len(self.pending) + len(self.flushing)
+
+    def exists(self, category, key):
+        # Before the cache has loaded only the queue is known; apply_submissions checks the rest
+        return key in self.keys[category] or (self.cache.loaded and self.cache.get(category, key) is not None)
+
+    def take(self):
+        """ Move the queued submissions to the flush in progress; return them and how many are replays """
+        with self.lock:
+            self.flushing, self.pending = self.pending, []
+            self.flushing_replayed, self.replayed = self.replayed, 0
+            return list(self.flushing), self.flushing_replayed
+
+    def flushed(self, committed):
+        """ End the flush in progress: forget its submissions if they were committed, else queue them again """
+        with self.lock:
+            if committed:
+                for kind, values in self.flushing:
+                    self.keys[KINDS[kind][0]].discard(values[0])
+                if self.file is not None:
+                    if self.pending:
+                        self.file.write(json.dumps({"flushed": len(self.flushing)}) + "\n")
+                    else:
+                        self.file.truncate(0)
+                    self.file.flush()
+                self.flushing = []
+            else:
+                self.pending, self.flushing = self.flushing + self.pending, []
+                self.replayed = self.flushing_replayed
+
+    def count(self):
+        with self.lock:
+            return len(self.pending) + len(self.flushing)
+
+    def close(self):
+        """ Close the queue file, removing it first if nothing is left to write """
+        with self.lock:
+            if self.file is None:
+                return
+            empty = not self.pending and not self.flushing
+            if empty and fcntl is not None:
+                # Removed while still locked, so no other process can take it in between
+                os.remove(self.path)
+            self.file.close()
+            self.file = None
+            if empty and fcntl is None:
+                # Windows cannot remove an open file
+                os.remove(self.path)